@@ -3,6 +3,8 @@ from discord.ext import commands
 import os
 import config
 import logging
+import cogs.utils.http as http
+import cogs.utils.cache as cache
 
 
 log = logging.getLogger("discord")
@@ -23,7 +25,23 @@ intents.dm_typing = False
 intents.webhooks = False
 intents.integrations = False
 
-bot = commands.Bot(
+
+class Bot(commands.Bot):
+    """A bot with an aiohttp session shared by every cog."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.client_session = self.loop.run_until_complete(http.create_session())
+        # Loaded on the db thread before any cog can use the cache
+        self.loop.run_until_complete(cache.load())
+
+    async def close(self):
+        """Closes the shared session after the bot has logged out."""
+        await super().close()
+        await self.client_session.close()
+
+
+bot = Bot(
     intents=intents,
     command_prefix=commands.when_mentioned_or("."),
     case_insensitive=True,
@@ -1,8 +1,8 @@
 import discord
 from discord.ext import commands
 import orjson
-import asyncio
 import cogs.utils.database as DB
+import cogs.utils.scheduler as scheduler
 
 
 class admin(commands.Cog):
@@ -10,7 +10,11 @@ class admin(commands.Cog):
 
     def __init__(self, bot: commands.Bot) -> None:
         self.bot = bot
-        self.loop = asyncio.get_event_loop()
+        scheduler.register("undownvote", self.undownvote)
+
+    def cog_unload(self):
+        """Stops running downvote timers while the cog is unloaded."""
+        scheduler.unregister("undownvote")
 
     async def cog_check(self, ctx):
         """Checks if the member is an administrator.
@@ -363,6 +367,14 @@ class admin(commands.Cog):
 
         return seconds
 
+    @staticmethod
+    async def undownvote(member_id):
+        """Removes a member from the downvote list when their downvote ends.
+
+        member_id: str
+        """
+        DB.blacklist.delete(member_id.encode())
+
     @commands.command()
     async def downvote(self, ctx, member: discord.Member = None, *, duration=None):
         """Automatically downvotes someone.
@@ -397,8 +409,12 @@ class admin(commands.Cog):
 
         member_id = f"{ctx.guild.id}-{str(member.id)}".encode()
 
+        # Any timed downvote is cancelled so its timer can't remove a newer one
+        timer = f"downvote-{member_id.decode()}"
+
         if DB.blacklist.get(member_id):
             DB.blacklist.delete(member_id)
+            scheduler.cancel(timer)
 
             embed.title = "User Undownvoted"
             embed.description = (
@@ -410,6 +426,7 @@ class admin(commands.Cog):
 
         if not duration:
             DB.blacklist.put(member_id, b"1")
+            scheduler.cancel(timer)
             embed.title = "User Downvoted"
             embed.description = f"**{member}** has been added to the downvote list"
             return await ctx.send(embed=embed)
@@ -421,7 +438,7 @@ class admin(commands.Cog):
             return await ctx.send(embed=embed)
 
         DB.blacklist.put(member_id, b"1")
-        self.loop.call_later(seconds, DB.blacklist.delete, member_id)
+        scheduler.schedule(seconds, "undownvote", member_id.decode(), name=timer)
 
         embed.title = "User Undownvoted"
         embed.description = f"***{member}*** has been added from the downvote list"
@@ -432,6 +449,7 @@ class admin(commands.Cog):
         """Wipes everyone from the downvote list."""
         for member, value in DB.blacklist:
             DB.blacklist.delete(member)
+            scheduler.cancel(f"downvote-{member.decode()}")
 
     @commands.command()
     async def blacklist(self, ctx, user: discord.User = None):
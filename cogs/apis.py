@@ -4,11 +4,100 @@ import asyncio
 import random
 import discord
 import re
+from collections import deque
 from datetime import datetime
 import textwrap
-import orjson
 import html
-import cogs.utils.database as DB
+import logging
+import orjson
+import cogs.utils.cache as cache
+import cogs.utils.http as http
+
+
+POOL_SIZE = 8
+POOL_WATERMARK = 3
+
+# The random image apis with a function to get the image url from their json
+IMAGE_APIS = {
+    "racoon": ("https://some-random-api.ml/img/racoon", lambda data: data["link"]),
+    "kangaroo": (
+        "https://some-random-api.ml/img/kangaroo",
+        lambda data: data["link"],
+    ),
+    "koala": ("https://some-random-api.ml/img/koala", lambda data: data["link"]),
+    "bird": ("https://some-random-api.ml/img/birb", lambda data: data["link"]),
+    "bird2": ("http://shibe.online/api/birds", lambda data: data[0]),
+    "redpanda": (
+        "https://some-random-api.ml/img/red_panda",
+        lambda data: data["link"],
+    ),
+    "panda": ("https://some-random-api.ml/img/panda", lambda data: data["link"]),
+    "fox": ("https://randomfox.ca/floof", lambda data: data["image"]),
+    "fox2": (
+        "https://wohlsoft.ru/images/foxybot/randomfox.php",
+        lambda data: data["file"],
+    ),
+    "cat": ("https://aws.random.cat/meow", lambda data: data["file"]),
+    "cat2": (
+        "https://api.thecatapi.com/v1/images/search",
+        lambda data: data[0]["url"],
+    ),
+    "cat3": (
+        "https://cataas.com/cat?json=true",
+        lambda data: f"https://cataas.com{data['url']}",
+    ),
+    "cat4": ("https://thatcopy.pw/catapi/rest", lambda data: data["webpurl"]),
+    "cat5": ("http://shibe.online/api/cats", lambda data: data[0]),
+    "dog": (
+        "https://dog.ceo/api/breeds/image/random",
+        lambda data: data["message"],
+    ),
+    "dog2": ("https://random.dog/woof.json", lambda data: data["url"]),
+    "shibe": ("http://shibe.online/api/shibes", lambda data: data[0]),
+}
+
+
+class ImagePool:
+    """A buffer of image urls prefetched from a random image api.
+
+    fetch: Callable[[bool], Awaitable[str]]
+        Gets an image url taking whether to wait if rate limited.
+    """
+
+    def __init__(self, fetch):
+        self.fetch = fetch
+        self.urls = deque(maxlen=POOL_SIZE)
+        self.task = None
+        self.hits = 0
+        self.misses = 0
+
+    def refill(self):
+        """Starts filling the pool in the background if it isn't already."""
+        if not self.task or self.task.done():
+            self.task = asyncio.get_event_loop().create_task(self._refill())
+
+    async def _refill(self):
+        while len(self.urls) < POOL_SIZE:
+            try:
+                self.urls.append(await self.fetch(True))
+            except Exception as e:
+                # Stop until the next get so a failing api isn't retried forever
+                logging.getLogger("discord").warning(f"Image pool refill failed: {e}")
+                return
+
+    async def get(self):
+        """Gets an image url from the pool falling back to fetching one."""
+        if self.urls:
+            self.hits += 1
+            url = self.urls.popleft()
+        else:
+            self.misses += 1
+            url = await self.fetch(False)
+
+        if len(self.urls) < POOL_WATERMARK:
+            self.refill()
+
+        return url
 
 
 class apis(commands.Cog):
@@ -17,23 +106,63 @@ class apis(commands.Cog):
     def __init__(self, bot: commands.Bot) -> None:
         self.bot = bot
         self.loop = asyncio.get_event_loop()
+        self.pools = {}
+
+        for name, (url, get_url) in IMAGE_APIS.items():
+            self.pools[name] = pool = ImagePool(self.image_fetcher(url, get_url))
+            pool.refill()
+
+    def cog_unload(self):
+        """Stops refilling the image pools."""
+        for pool in self.pools.values():
+            if pool.task:
+                pool.task.cancel()
+
+    def image_fetcher(self, url, get_url):
+        """Returns a function that gets a random image url from an api.
 
-    @staticmethod
-    async def get_json(url):
+        url: str
+        get_url: Callable[[Any], str]
+            Gets the image url from the apis json.
+        """
+
+        async def fetch(wait):
+            # Every request should get a different image so they aren't shared
+            return get_url(await self.get_json(url, wait, coalesce=False))
+
+        return fetch
+
+    async def get_json(self, url, wait=True, coalesce=True):
         """Gets and loads json from a url.
 
+        Concurrent calls for the same url share one request.
+
         url: str
             The url to fetch the json from.
+        wait: bool
+            Whether to wait if the host is rate limited or raise
+            http.RateLimited immediately.
+        coalesce: bool
+            Whether to share the request with concurrent calls.
         """
+
+        async def fetch():
+            # The token is acquired first so waiting for it doesn't use up
+            # the requests timeout
+            await http.acquire(url, wait)
+
+            async with self.bot.client_session.get(
+                url,
+                timeout=aiohttp.ClientTimeout(total=6),
+                trace_request_ctx={"acquired": True},
+            ) as response:
+                return await response.read()
+
         try:
-            async with aiohttp.ClientSession(
-                timeout=aiohttp.ClientTimeout(total=6)
-            ) as session, session.get(url) as response:
-                return await response.json()
-        except (
-            asyncio.exceptions.TimeoutError,
-            aiohttp.client_exceptions.ContentTypeError,
-        ):
+            if coalesce:
+                return orjson.loads(await http.single_flight(url, fetch))
+            return orjson.loads(await fetch())
+        except (asyncio.exceptions.TimeoutError, orjson.JSONDecodeError):
             return None
 
     @commands.command()
@@ -452,9 +581,9 @@ class apis(commands.Cog):
         url = "https://icanhazdadjoke.com/"
         headers = {"Accept": "application/json"}
 
-        async with ctx.typing(), aiohttp.ClientSession(
-            headers=headers
-        ) as session, session.get(url) as reponse:
+        async with ctx.typing(), self.bot.client_session.get(
+            url, headers=headers
+        ) as reponse:
             data = await reponse.json()
 
             await ctx.reply(data["joke"])
@@ -668,7 +797,7 @@ class apis(commands.Cog):
             f"&remhost=quicklatex.com&preamble={preamble}"
         )
 
-        async with ctx.typing(), aiohttp.ClientSession() as session, session.post(
+        async with ctx.typing(), self.bot.client_session.post(
             url, data=data
         ) as response:
             res = await response.text()
@@ -696,72 +825,37 @@ class apis(commands.Cog):
     @commands.command()
     async def racoon(self, ctx):
         """Gets a random racoon image."""
-        url = "https://some-random-api.ml/img/racoon"
-
-        async with ctx.typing():
-            image = await self.get_json(url)
-
-        await ctx.send(image["link"])
+        await ctx.send(await self.pools["racoon"].get())
 
     @commands.command()
     async def kangaroo(self, ctx):
         """Gets a random kangaroo image."""
-        url = "https://some-random-api.ml/img/kangaroo"
-
-        async with ctx.typing():
-            image = await self.get_json(url)
-
-        await ctx.send(image["link"])
+        await ctx.send(await self.pools["kangaroo"].get())
 
     @commands.command()
     async def koala(self, ctx):
         """Gets a random koala image."""
-        url = "https://some-random-api.ml/img/koala"
-
-        async with ctx.typing():
-            image = await self.get_json(url)
-
-        await ctx.send(image["link"])
+        await ctx.send(await self.pools["koala"].get())
 
     @commands.command()
     async def bird(self, ctx):
         """Gets a random bird image."""
-        url = "https://some-random-api.ml/img/birb"
-
-        async with ctx.typing():
-            image = await self.get_json(url)
-
-        await ctx.send(image["link"])
+        await ctx.send(await self.pools["bird"].get())
 
     @commands.command()
     async def bird2(self, ctx):
         """Gets a random bird image."""
-        url = "http://shibe.online/api/birds"
-
-        async with ctx.typing():
-            image = await self.get_json(url)
-
-        await ctx.send(image[0])
+        await ctx.send(await self.pools["bird2"].get())
 
     @commands.command()
     async def redpanda(self, ctx):
         """Gets a random red panda image."""
-        url = "https://some-random-api.ml/img/red_panda"
-
-        async with ctx.typing():
-            image = await self.get_json(url)
-
-        await ctx.send(image["link"])
+        await ctx.send(await self.pools["redpanda"].get())
 
     @commands.command()
     async def panda(self, ctx):
         """Gets a random panda image."""
-        url = "https://some-random-api.ml/img/panda"
-
-        async with ctx.typing():
-            image = await self.get_json(url)
-
-        await ctx.send(image["link"])
+        await ctx.send(await self.pools["panda"].get())
 
     @commands.command()
     async def avatar(self, ctx, *, seed=""):
@@ -775,72 +869,37 @@ class apis(commands.Cog):
     @commands.command()
     async def fox(self, ctx):
         """Gets a random fox image."""
-        url = "https://randomfox.ca/floof"
-
-        async with ctx.typing():
-            image = await self.get_json(url)
-
-        await ctx.send(image["image"])
+        await ctx.send(await self.pools["fox"].get())
 
     @commands.command()
     async def fox2(self, ctx):
         """Gets a random fox image."""
-        url = "https://wohlsoft.ru/images/foxybot/randomfox.php"
-
-        async with ctx.typing():
-            image = await self.get_json(url)
-
-        await ctx.send(image["file"])
+        await ctx.send(await self.pools["fox2"].get())
 
     @commands.command()
     async def cat(self, ctx):
         """Gets a random cat image."""
-        url = "https://aws.random.cat/meow"
-
-        async with ctx.typing():
-            image = await self.get_json(url)
-
-        await ctx.send(image["file"])
+        await ctx.send(await self.pools["cat"].get())
 
     @commands.command()
     async def cat2(self, ctx):
         """Gets a random cat image."""
-        url = "https://api.thecatapi.com/v1/images/search"
-
-        async with ctx.typing():
-            image = await self.get_json(url)
-
-        await ctx.send(image[0]["url"])
+        await ctx.send(await self.pools["cat2"].get())
 
     @commands.command()
     async def cat3(self, ctx):
         """Gets a random cat image."""
-        url = "https://cataas.com/cat?json=true"
-
-        async with ctx.typing():
-            image = await self.get_json(url)
-
-        await ctx.send(f"https://cataas.com{image['url']}")
+        await ctx.send(await self.pools["cat3"].get())
 
     @commands.command()
     async def cat4(self, ctx):
         """Gets a random cat image."""
-        url = "https://thatcopy.pw/catapi/rest"
-
-        async with ctx.typing():
-            image = await self.get_json(url)
-
-        await ctx.send(image["webpurl"])
+        await ctx.send(await self.pools["cat4"].get())
 
     @commands.command()
     async def cat5(self, ctx):
         """Gets a random cat image."""
-        url = "http://shibe.online/api/cats"
-
-        async with ctx.typing():
-            image = await self.get_json(url)
-
-        await ctx.send(image[0])
+        await ctx.send(await self.pools["cat5"].get())
 
     @commands.command(name="catstatus")
     async def cat_status(self, ctx, status):
@@ -850,25 +909,20 @@ class apis(commands.Cog):
     @commands.command()
     async def dog(self, ctx, breed=None):
         """Gets a random dog image."""
-        if breed:
-            url = f"https://dog.ceo/api/breed/{breed}/images/random"
-        else:
-            url = "https://dog.ceo/api/breeds/image/random"
+        if not breed:
+            return await ctx.send(await self.pools["dog"].get())
+
+        url = f"https://dog.ceo/api/breed/{breed}/images/random"
 
         async with ctx.typing():
-            image = await self.get_json(url)
+            image = await self.get_json(url, wait=False)
 
         await ctx.send(image["message"])
 
     @commands.command()
     async def dog2(self, ctx):
         """Gets a random dog image."""
-        url = "https://random.dog/woof.json"
-
-        async with ctx.typing():
-            image = await self.get_json(url)
-
-        await ctx.send(image["url"])
+        await ctx.send(await self.pools["dog2"].get())
 
     @commands.command(name="dogstatus")
     async def dog_status(self, ctx, status):
@@ -878,12 +932,7 @@ class apis(commands.Cog):
     @commands.command()
     async def shibe(self, ctx):
         """Gets a random dog image."""
-        url = "http://shibe.online/api/shibes"
-
-        async with ctx.typing():
-            image = await self.get_json(url)
-
-        await ctx.send(image[0])
+        await ctx.send(await self.pools["shibe"].get())
 
     @commands.command()
     async def qr(self, ctx, *, text):
@@ -926,14 +975,13 @@ class apis(commands.Cog):
         search: str
             The term to search for.
         """
-        cache_search = f"urban-{search}"
-        cache = orjson.loads(DB.db.get(b"cache"))
-
-        if cache_search in cache:
-            defin = cache[cache_search].pop()
+        if definitions := cache.get("urban", search):
+            defin = definitions.pop()
 
-            if len(cache[cache_search]) == 0:
-                cache.pop(cache_search)
+            if definitions:
+                cache.update("urban", search, definitions)
+            else:
+                cache.delete("urban", search)
         else:
             url = f"https://api.urbandictionary.com/v0/define?term={search}"
 
@@ -950,7 +998,9 @@ class apis(commands.Cog):
             urban["list"].sort(key=lambda defin: defin["thumbs_up"])
 
             defin = urban["list"].pop()
-            cache[cache_search] = urban["list"]
+
+            if urban["list"]:
+                cache.put("urban", search, urban["list"], persist=True)
 
         embed = discord.Embed(colour=discord.Color.blurple())
 
@@ -966,8 +1016,6 @@ class apis(commands.Cog):
             defin["thumbs_up"],
         )
 
-        DB.db.put(b"cache", orjson.dumps(cache))
-        self.loop.call_later(300, DB.delete_cache, cache_search, cache)
         await ctx.send(embed=embed)
 
     @commands.command(aliases=["wiki"])
@@ -1131,17 +1179,14 @@ class apis(commands.Cog):
         search: str
             The gif search term.
         """
-        cache_search = f"tenor-{search}"
-        cache = orjson.loads(DB.db.get(b"cache"))
+        if gifs := cache.get("tenor", search):
+            url = random.choice(gifs)
+            gifs.remove(url)
 
-        if cache_search in cache:
-            url = random.choice(cache[cache_search])
-            cache[cache_search].remove(url)
-
-            if len(cache[cache_search]) == 0:
-                cache.pop(cache_search)
-
-            DB.db.put(b"cache", orjson.dumps(cache))
+            if gifs:
+                cache.update("tenor", search, gifs)
+            else:
+                cache.delete("tenor", search)
 
             return await ctx.send(url)
 
@@ -1153,10 +1198,10 @@ class apis(commands.Cog):
         tenor = [image["media"][0]["gif"]["url"] for image in tenor["results"]]
         image = random.choice(tenor)
         tenor.remove(image)
-        cache[cache_search] = tenor
 
-        DB.db.put(b"cache", orjson.dumps(cache))
-        self.loop.call_later(300, DB.delete_cache, cache_search, cache)
+        if tenor:
+            cache.put("tenor", search, tenor, persist=True)
+
         await ctx.send(image)
 
 
@@ -1,18 +1,81 @@
 import aiohttp
 import os
 import asyncio
+import logging
+import re
 import subprocess
 import orjson
 from discord.ext import commands, tasks
 import discord
 import cogs.utils.database as DB
 
+# Matches a JSON object without any nested objects or arrays
+FLAT_OBJECT = re.compile(rb'\{(?:[^{}"]|"(?:[^"\\]|\\.)*")*\}')
+ARRAY_SEPARATOR = re.compile(rb"\s*,?\s*")
+STOCK_BATCH_SIZE = 1000
+
+
+class PriceDiff:
+    """Keeps a hash of the last record written for each symbol in a prefix.
+
+    Used by the price tasks to only write the records that have changed.
+    """
+
+    def __init__(self, prefixed):
+        self.prefixed = prefixed
+        self.hashes = None
+        self.seen = {}
+        self.counts = {"changed": 0, "unchanged": 0, "new": 0}
+        self.stats = (0, 0, 0, 0)
+
+    async def start(self):
+        """Starts a new update loading the hashes from the db if needed."""
+        if self.hashes is None:
+            self.hashes = await DB.run(
+                lambda: {symbol: hash(data) for symbol, data in self.prefixed}
+            )
+
+        self.seen = {}
+        self.counts = {"changed": 0, "unchanged": 0, "new": 0}
+
+    def changed(self, symbol, data):
+        """Returns whether a record is different to the one last written.
+
+        symbol: bytes
+        data: bytes
+        """
+        old = self.hashes.get(symbol)
+        self.seen[symbol] = new = hash(data)
+
+        if old == new:
+            self.counts["unchanged"] += 1
+            return False
+
+        self.counts["new" if old is None else "changed"] += 1
+        return True
+
+    def finish(self):
+        """Finishes an update counting the symbols that weren't in it."""
+        delisted = len(self.hashes.keys() - self.seen.keys())
+        self.hashes = self.seen
+        self.seen = {}
+        self.stats = (
+            self.counts["changed"],
+            self.counts["unchanged"],
+            self.counts["new"],
+            delisted,
+        )
+
 
 class background_tasks(commands.Cog):
     """Commands related to the background tasks of the bot."""
 
     def __init__(self, bot: commands.Bot) -> None:
         self.bot = bot
+        self.price_diffs = {
+            "update_stocks": PriceDiff(DB.stocks),
+            "crypto_update": PriceDiff(DB.crypto),
+        }
         self.start_tasks()
 
     def cog_unload(self):
@@ -157,6 +220,11 @@ class background_tasks(commands.Cog):
         update_bot          0h 5m 0s       True/False/240
         update_languages    0h 0m 0s       False/False/1
         update_stocks       0h 30m 0s      True/False/40
+
+        Name:               Changed/Unchanged/New/Delisted:
+
+        crypto_update       120/9512/0/2
+        update_stocks       2841/4410/3/0
         """
         embed = discord.Embed(color=discord.Color.blurple())
 
@@ -171,38 +239,119 @@ class background_tasks(commands.Cog):
                 task_obj.current_loop,
             )
 
+        msg += "\nName:               Changed/Unchanged/New/Delisted:\n\n"
+        for task, diff in self.price_diffs.items():
+            msg += "{:<20}{}/{}/{}/{}\n".format(task, *diff.stats)
+
         embed.description = f"```\n{msg}```"
         await ctx.send(embed=embed)
 
+    @staticmethod
+    async def stream_array(response, key):
+        """Yields the items of a JSON array as the response is downloaded.
+
+        Only the array of the first key with the name is parsed and its items
+        have to be objects without any nested objects or arrays. Raises
+        ValueError if the array is missing or the response ends inside it.
+
+        response: aiohttp.ClientResponse
+        key: bytes
+            The name of the key the array is under.
+        """
+        start = re.compile(rb'"' + re.escape(key) + rb'"\s*:\s*\[')
+        buffer = b""
+        pos = None
+
+        async for chunk in response.content.iter_chunked(65536):
+            buffer += chunk
+
+            if pos is None:
+                if not (match := start.search(buffer)):
+                    # Keep the end in case the key is split between chunks
+                    buffer = buffer[-len(key) - 64 :]
+                    continue
+                pos = match.end()
+
+            while True:
+                pos = ARRAY_SEPARATOR.match(buffer, pos).end()
+
+                if buffer.startswith(b"]", pos):
+                    return
+
+                if not (match := FLAT_OBJECT.match(buffer, pos)):
+                    break
+
+                yield orjson.loads(match.group())
+                pos = match.end()
+
+            buffer = buffer[pos:]
+            pos = 0
+
+        if pos is None:
+            raise ValueError(f"The response has no {key.decode()} array")
+        raise ValueError(f"The {key.decode()} array ended early")
+
     @tasks.loop(minutes=10)
     async def update_stocks(self):
-        """Updates stock data every 10 minutes."""
+        """Updates stock data every 10 minutes.
+
+        The rows are parsed as they are downloaded and written in batches
+        so the whole response is never held in memory at once.
+        """
         url = "https://api.nasdaq.com/api/screener/stocks?limit=50000"
         headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.67 Safari/537.36",
             "accept-language": "en-US,en;q=0.9",
         }
-        async with aiohttp.ClientSession(headers=headers) as session, session.get(
-            url
-        ) as response:
-            stocks = await response.json()
-
-        with DB.stocks.write_batch() as wb:
-            for stock in stocks["data"]["table"]["rows"]:
-                stock_data = {
-                    "name": stock["name"],
-                    "price": stock["lastsale"][1:],
-                    "change": stock["netchange"],
-                    "%change": stock["pctchange"][:-1]
-                    if stock["pctchange"] != "--"
-                    else 0,
-                    "cap": stock["marketCap"],
-                }
-
-                wb.put(
-                    stock["symbol"].encode(),
-                    orjson.dumps(stock_data),
-                )
+        prices = {}
+        rows = []
+        ticks = []
+        diff = self.price_diffs["update_stocks"]
+        await diff.start()
+
+        def write_rows(rows):
+            with DB.stocks.write_batch() as wb:
+                for symbol, data in rows:
+                    wb.put(symbol, data)
+
+        # The screener is streamed so only the time between reads is limited
+        try:
+            async with self.bot.client_session.get(
+                url, headers=headers, timeout=aiohttp.ClientTimeout(sock_read=60)
+            ) as response:
+                async for stock in self.stream_array(response, b"rows"):
+                    stock_data = {
+                        "name": stock["name"],
+                        "price": stock["lastsale"][1:],
+                        "change": stock["netchange"],
+                        "%change": stock["pctchange"][:-1]
+                        if stock["pctchange"] != "--"
+                        else 0,
+                        "cap": stock["marketCap"],
+                    }
+
+                    prices[stock["symbol"]] = stock_data["price"]
+                    symbol = stock["symbol"].encode()
+                    data = orjson.dumps(stock_data)
+
+                    if not diff.changed(symbol, data):
+                        continue
+
+                    rows.append((symbol, data))
+                    ticks.append((stock["symbol"], stock_data["price"]))
+
+                    if len(rows) == STOCK_BATCH_SIZE:
+                        await DB.run(write_rows, rows)
+                        rows = []
+        except ValueError as e:
+            # A partial update would mark the missing stocks as delisted and
+            # value their holdings at 0 so it is dropped until the next run
+            return logging.getLogger("discord").warning(f"Stock update failed: {e}")
+
+        await DB.run(write_rows, rows)
+        await DB.add_ticks("stocks", ticks)
+        diff.finish()
+        await DB.update_prices("stocks", prices)
 
     async def run_process(self, command):
         """Runs a shell command and returns the output.
@@ -254,14 +403,14 @@ class background_tasks(commands.Cog):
         if not number:
             number = -1
         else:
-            number = int(number.decode())
+            number = DB.unpack_int(number)
 
         number += 1
 
         if number == 11:
             number = 0
 
-        DB.db.put(b"backup_number", str(number).encode())
+        DB.db.put(b"backup_number", DB.pack_int(number))
 
         os.makedirs("backup/", exist_ok=True)
         with open(f"backup/{number}backup.json", "w", encoding="utf-8") as file:
@@ -269,11 +418,24 @@ class background_tasks(commands.Cog):
             # Basically it just formats the db to json
             json = "".join(
                 [
-                    f'"{key.decode()}": "{value.decode()}", '
-                    if '"' not in value.decode()
-                    else f'"{key.decode()}": {value.decode()}, '
-                    for key, value in DB.db
-                    if not key.startswith(b"crypto-") and not key.startswith(b"stocks-")
+                    f'"{key}": "{value}", '
+                    if '"' not in value
+                    else f'"{key}": {value}, '
+                    for key, value in (
+                        DB.decode(key, value)
+                        for key, value in DB.db
+                        if not key.startswith(
+                            (
+                                b"crypto-",
+                                b"stocks-",
+                                b"baltop-",
+                                b"stockhistory-",
+                                b"cryptohistory-",
+                                b"cache-",
+                                b"chessmoves-",
+                            )
+                        )
+                    )
                 ]
             )
             file.write(f"{{{json[:-3]}}}")
@@ -282,7 +444,7 @@ class background_tasks(commands.Cog):
     async def update_languages(self):
         """Updates pistons supported languages for the run command."""
         url = "https://emkc.org/api/v1/piston/versions"
-        async with aiohttp.ClientSession() as session, session.get(url) as page:
+        async with self.bot.client_session.get(url) as page:
             data = await page.json()
 
         languages = set()
@@ -297,30 +459,49 @@ class background_tasks(commands.Cog):
     async def crypto_update(self):
         """Updates crypto currency data every 10 minutes."""
         url = "https://api.coinmarketcap.com/data-api/v3/cryptocurrency/listing?limit=50000&convert=NZD&cryptoType=coins"
-        async with aiohttp.ClientSession() as session, session.get(url) as response:
+        async with self.bot.client_session.get(url) as response:
             crypto = await response.json()
 
+        prices = {}
+        ticks = []
+        diff = self.price_diffs["crypto_update"]
+        await diff.start()
+
         with DB.crypto.write_batch() as wb:
             for coin in crypto["data"]["cryptoCurrencyList"]:
                 if "price" not in coin["quotes"][0]:
                     continue
 
-                wb.put(
-                    coin["symbol"].encode(),
-                    orjson.dumps(
-                        {
-                            "name": coin["name"],
-                            "id": coin["id"],
-                            "price": coin["quotes"][0]["price"],
-                            "circulating_supply": coin["circulatingSupply"],
-                            "max_supply": coin.get("maxSupply", 0),
-                            "market_cap": coin["quotes"][0].get("marketCap", 0),
-                            "change_24h": coin["quotes"][0]["percentChange24h"],
-                            "volume_24h": coin["quotes"][0].get("volume24h", 0),
-                        }
-                    ),
+                prices[coin["symbol"]] = coin["quotes"][0]["price"]
+
+                symbol = coin["symbol"].encode()
+                data = orjson.dumps(
+                    {
+                        "name": coin["name"],
+                        "id": coin["id"],
+                        "price": coin["quotes"][0]["price"],
+                        "circulating_supply": coin["circulatingSupply"],
+                        "max_supply": coin.get("maxSupply", 0),
+                        "market_cap": coin["quotes"][0].get("marketCap", 0),
+                        "change_24h": coin["quotes"][0]["percentChange24h"],
+                        "volume_24h": coin["quotes"][0].get("volume24h", 0),
+                    }
                 )
 
+                if diff.changed(symbol, data):
+                    wb.put(symbol, data)
+                    ticks.append((coin["symbol"], coin["quotes"][0]["price"]))
+
+        await DB.add_ticks("crypto", ticks)
+        diff.finish()
+        await DB.update_prices("crypto", prices)
+
+    @tasks.loop(hours=24)
+    async def compact_history(self):
+        """Compacts the price history and applies its retention policy."""
+        await DB.compact_history("stocks")
+        await DB.compact_history("crypto")
+
 
 def setup(bot):
     bot.add_cog(background_tasks(bot))
@@ -1,438 +1,177 @@
 from discord.ext import commands
 import discord
 import re
-import time
-from itertools import count
-from collections import namedtuple
 import io
-from PIL import Image, ImageDraw, ImageFont
 import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+import cogs.utils.book as book
 import cogs.utils.database as DB
+import cogs.utils.images as images
+from cogs.utils.sunfish import LEVELS, MATE_LOWER, MATE_UPPER, Position, initial
+from cogs.utils.sunfish import end_game, new_game, parse, position_key, think
 
-# Source
-# https://github.com/thomasahle/sunfish/blob/master/LICENSE.md
-# https://github.com/thomasahle/sunfish
-# Modified a little to work with discord
-
-# fmt: off
-
-piece = {'P': 100, 'N': 280, 'B': 320, 'R': 479, 'Q': 929, 'K': 60000}
-pst = {
-    'P': (0,   0,   0,   0,   0,   0,   0,   0,
-          78,  83,  86,  73, 102,  82,  85,  90,
-          7,  29,  21,  44,  40,  31,  44,   7,
-          -17,  16,  -2,  15,  14,   0,  15, -13,
-          -26,   3,  10,   9,   6,   1,   0, -23,
-          -22,   9,   5, -11, -10,  -2,   3, -19,
-          -31,   8,  -7, -37, -36, -14,   3, -31,
-          0,   0,   0,   0,   0,   0,   0,   0),
-    'N': (-66, -53, -75, -75, -10, -55, -58, -70,
-          -3,  -6, 100, -36,   4,  62,  -4, -14,
-          10,  67,   1,  74,  73,  27,  62,  -2,
-          24,  24,  45,  37,  33,  41,  25,  17,
-          -1,   5,  31,  21,  22,  35,   2,   0,
-          -18,  10,  13,  22,  18,  15,  11, -14,
-          -23, -15,   2,   0,   2,   0, -23, -20,
-          -74, -23, -26, -24, -19, -35, -22, -69),
-    'B': (-59, -78, -82, -76, -23, -107, -37, -50,
-          -11,  20,  35, -42, -39,  31,   2, -22,
-          -9,  39, -32,  41,  52, -10,  28, -14,
-          25,  17,  20,  34,  26,  25,  15,  10,
-          13,  10,  17,  23,  17,  16,   0,   7,
-          14,  25,  24,  15,   8,  25,  20,  15,
-          19,  20,  11,   6,   7,   6,  20,  16,
-          -7,   2, -15, -12, -14, -15, -10, -10),
-    'R': (35,  29,  33,   4,  37,  33,  56,  50,
-          55,  29,  56,  67,  55,  62,  34,  60,
-          19,  35,  28,  33,  45,  27,  25,  15,
-          0,   5,  16,  13,  18,  -4,  -9,  -6,
-          -28, -35, -16, -21, -13, -29, -46, -30,
-          -42, -28, -42, -25, -25, -35, -26, -46,
-          -53, -38, -31, -26, -29, -43, -44, -53,
-          -30, -24, -18,   5,  -2, -18, -31, -32),
-    'Q': (6,   1, -8, -104, 69,  24, 88, 26,
-          14,  32,  60, -10,  20,  76,  57,  24,
-          -2,  43,  32,  60,  72,  63,  43,   2,
-          1, -16,  22,  17,  25,  20, -13,  -6,
-          -14, -15,  -2,  -5,  -1, -10, -20, -22,
-          -30,  -6, -13, -11, -16, -11, -16, -27,
-          -36, -18,   0, -19, -15, -15, -21, -38,
-          -39, -30, -31, -13, -31, -36, -34, -42),
-    'K': (4,  54,  47, -99, -99,  60,  83, -62,
-          -32,  10,  55,  56,  56,  55,  10,   3,
-          -62,  12, -57,  44, -67,  28,  37, -31,
-          -55,  50,  11,  -4, -19,  13,   0, -49,
-          -55, -43, -52, -28, -51, -47,  -8, -50,
-          -47, -42, -43, -79, -64, -32, -29, -32,
-          -4,   3, -14, -50, -57, -18,  13,   4,
-          17,  30,  -3, -14,   6,  -1,  40,  18),
-}
-
-# fmt: on
-
-for k, table in pst.items():
-
-    def padrow(row):
-        return (0,) + tuple(x + piece[k] for x in row) + (0,)
-
-    # fmt: off
-    pst[k] = sum((padrow(table[i * 8: i * 8 + 8]) for i in range(8)), ())
-    # fmt: on
-    pst[k] = (0,) * 20 + pst[k] + (0,) * 20
-
-
-A1, H1, A8, H8 = 91, 98, 21, 28
-initial = (
-    "         \n"  # 0 -  9
-    "         \n"  # 10 - 19
-    " rnbqkbnr\n"  # 20 - 29
-    " pppppppp\n"  # 30 - 39
-    " ........\n"  # 40 - 49
-    " ........\n"  # 50 - 59
-    " ........\n"  # 60 - 69
-    " ........\n"  # 70 - 79
-    " PPPPPPPP\n"  # 80 - 89
-    " RNBQKBNR\n"  # 90 - 99
-    "         \n"  # 100 -109
-    "         \n"  # 110 -119
-)
-
-N, E, S, W = -10, 1, 10, -1
-directions = {
-    "P": (N, N + N, N + W, N + E),
-    "N": (
-        N + N + E,
-        E + N + E,
-        E + S + E,
-        S + S + E,
-        S + S + W,
-        W + S + W,
-        W + N + W,
-        N + N + W,
-    ),
-    "B": (N + E, S + E, S + W, N + W),
-    "R": (N, E, S, W),
-    "Q": (N, E, S, W, N + E, S + E, S + W, N + W),
-    "K": (N, E, S, W, N + E, S + E, S + W, N + W),
-}
-
-MATE_LOWER = piece["K"] - 10 * piece["Q"]
-MATE_UPPER = piece["K"] + 10 * piece["Q"]
-
-TABLE_SIZE = 1e7
-
-QS_LIMIT = 219
-EVAL_ROUGHNESS = 13
-DRAW_TEST = True
-
-
-class Position(namedtuple("Position", "board score wc bc ep kp")):
-    """A state of a chess game.
-    board -- a 120 char representation of the board
-    score -- the board evaluation
-    wc -- the castling rights, [west/queen side, east/king side]
-    bc -- the opponent castling rights, [west/king side, east/queen side]
-    ep - the en passant square
-    kp - the king passant square
-    """
-
-    def gen_moves(self):
-        for i, p in enumerate(self.board):
-            if not p.isupper():
-                continue
-            for d in directions[p]:
-                for j in count(i + d, d):
-                    q = self.board[j]
-                    if q.isspace() or q.isupper():
-                        break
-                    if p == "P" and d in (N, N + N) and q != ".":
-                        break
-                    if (
-                        p == "P"
-                        and d == N + N
-                        and (i < A1 + N or self.board[i + N] != ".")
-                    ):
-                        break
-                    if (
-                        p == "P"
-                        and d in (N + W, N + E)
-                        and q == "."
-                        and j not in (self.ep, self.kp, self.kp - 1, self.kp + 1)
-                    ):
-                        break
-                    yield (i, j)
-                    if p in "PNK" or q.islower():
-                        break
-                    if i == A1 and self.board[j + E] == "K" and self.wc[0]:
-                        yield (j + E, j + W)
-                    if i == H1 and self.board[j + W] == "K" and self.wc[1]:
-                        yield (j + W, j + E)
-
-    def rotate(self):
-        """Rotates the board, preserving enpassant."""
-        return Position(
-            self.board[::-1].swapcase(),
-            -self.score,
-            self.bc,
-            self.wc,
-            119 - self.ep or 0,
-            119 - self.kp or 0,
-        )
-
-    def nullmove(self):
-        """Like rotate, but clears ep and kp."""
-        return Position(
-            self.board[::-1].swapcase(), -self.score, self.bc, self.wc, 0, 0
-        )
-
-    def move(self, move):
-        i, j = move
-        p = self.board[i]
-
-        def put(board, i, p):
-            # fmt: off
-            return board[:i] + p + board[i + 1:]
-            # fmt: on
-
-        board = self.board
-        wc, bc, ep, kp = self.wc, self.bc, 0, 0
-        score = self.score + self.value(move)
-
-        board = put(board, j, board[i])
-        board = put(board, i, ".")
-
-        if i == A1:
-            wc = (False, wc[1])
-        if i == H1:
-            wc = (wc[0], False)
-        if j == A8:
-            bc = (bc[0], False)
-        if j == H8:
-            bc = (False, bc[1])
-
-        if p == "K":
-            wc = (False, False)
-            if abs(j - i) == 2:
-                kp = (i + j) // 2
-                board = put(board, A1 if j < i else H1, ".")
-                board = put(board, kp, "R")
-
-        if p == "P":
-            if A8 <= j <= H8:
-                board = put(board, j, "Q")
-            if j - i == 2 * N:
-                ep = i + N
-            if j == self.ep:
-                board = put(board, j + S, ".")
-
-        return Position(board, score, wc, bc, ep, kp).rotate()
-
-    def value(self, move):
-        i, j = move
-        p, q = self.board[i], self.board[j]
-
-        score = pst[p][j] - pst[p][i]
-
-        if q.islower():
-            score += pst[q.upper()][119 - j]
-
-        if abs(j - self.kp) < 2:
-            score += pst["K"][119 - j]
-
-        if p == "K" and abs(i - j) == 2:
-            score += pst["R"][(i + j) // 2]
-            score -= pst["R"][A1 if j < i else H1]
-
-        if p == "P":
-            if A8 <= j <= H8:
-                score += pst["Q"][j] - pst["P"][j]
-            if j == self.ep:
-                score += pst["P"][119 - (j + S)]
-        return score
-
-
-Entry = namedtuple("Entry", "lower upper")
-
-
-class Searcher:
-    def __init__(self):
-        self.tp_score = {}
-        self.tp_move = {}
-        self.history = set()
-        self.nodes = 0
-
-    def bound(self, pos, gamma, depth, root=True):
-        """Returns r where.
-        s(pos) <= r < gamma    if gamma > s(pos)
-        gamma <= r <= s(pos)   if gamma <= s(pos)
-        """
-        self.nodes += 1
-
-        depth = max(depth, 0)
-
-        if pos.score <= -MATE_LOWER:
-            return -MATE_UPPER
-
-        if DRAW_TEST and not root and pos in self.history:
-            return 0
-
-        entry = self.tp_score.get((pos, depth, root), Entry(-MATE_UPPER, MATE_UPPER))
-        if entry.lower >= gamma and (not root or self.tp_move.get(pos) is not None):
-            return entry.lower
-        if entry.upper < gamma:
-            return entry.upper
 
-        def moves():
+# Searching is CPU bound so games share a few engine processes. A games
+# searcher lives in the process it started in so each game is pinned to the
+# process with the fewest games, which runs its games searches in the order
+# they were asked for so every game gets its turn.
+ENGINE_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+MAX_GAMES = ENGINE_WORKERS * 2
 
-            if depth > 0 and not root and any(c in pos.board for c in "RBNQ"):
-                yield None, -self.bound(
-                    pos.nullmove(), 1 - gamma, depth - 3, root=False
-                )
 
-            if depth == 0:
-                yield None, pos.score
-
-            killer = self.tp_move.get(pos)
-            if killer and (depth > 0 or pos.value(killer) >= QS_LIMIT):
-                yield killer, -self.bound(
-                    pos.move(killer), 1 - gamma, depth - 1, root=False
-                )
-
-            for move in sorted(pos.gen_moves(), key=pos.value, reverse=True):
+async def print_pos(ctx, pos):
+    image = await images.run(images.render_board, pos.board.decode())
 
-                if depth > 0 or pos.value(move) >= QS_LIMIT:
-                    yield move, -self.bound(
-                        pos.move(move), 1 - gamma, depth - 1, root=False
-                    )
+    with io.BytesIO(image) as image_binary:
+        return await ctx.send(file=discord.File(fp=image_binary, filename="image.png"))
 
-        best = -MATE_UPPER
-        for move, score in moves():
-            best = max(best, score)
-            if best >= gamma:
-                if len(self.tp_move) > TABLE_SIZE:
-                    self.tp_move.clear()
-                self.tp_move[pos] = move
-                break
 
-        if best < gamma and best < 0 and depth > 0:
+async def engine_move(engine, game_id, hist, level):
+    """Returns the engines move and its score.
 
-            def is_dead(pos):
-                return any(pos.value(m) >= MATE_LOWER for m in pos.gen_moves())
+    Book moves and positions already searched at least as strongly are
+    answered without searching, new searches are stored in the db.
 
-            if all(is_dead(pos.move(m)) for m in pos.gen_moves()):
-                in_check = is_dead(pos.nullmove())
-                best = -MATE_UPPER if in_check else 0
+    engine: concurrent.futures.ProcessPoolExecutor
+    game_id: int
+    hist: list
+        The positions of the game.
+    level: int
+    """
+    pos = hist[-1]
 
-        if len(self.tp_score) > TABLE_SIZE:
-            self.tp_score.clear()
+    if move := book.probe(pos):
+        return move, 0
 
-        if best >= gamma:
-            self.tp_score[pos, depth, root] = Entry(best, entry.upper)
-        if best < gamma:
-            self.tp_score[pos, depth, root] = Entry(entry.lower, best)
+    key = position_key(pos)
+    stored = await DB.get_chess_move(key)
 
-        return best
+    # Keys are checked against the legal moves in case of a collision
+    if stored and stored[0] >= level and stored[1] in pos.gen_moves():
+        return stored[1:]
 
-    def search(self, pos, history=()):
-        """Iterative deepening MTD-bi search."""
-        self.nodes = 0
-        if DRAW_TEST:
-            self.history = set(history)
-            self.tp_score.clear()
+    move, score = await asyncio.get_running_loop().run_in_executor(
+        engine, think, game_id, pos, hist, level
+    )
 
-        for depth in range(1, 1000):
-            lower, upper = -MATE_UPPER, MATE_UPPER
-            while lower < upper - EVAL_ROUGHNESS:
-                gamma = (lower + upper + 1) // 2
-                score = self.bound(pos, gamma, depth)
-                if score >= gamma:
-                    lower = score
-                if score < gamma:
-                    upper = score
+    if move:
+        DB.put_chess_move(key, level, move, score)
 
-            self.bound(pos, lower, depth)
+    return move, score
 
-            yield depth, self.tp_move.get(pos), self.tp_score.get(
-                (pos, depth, True)
-            ).lower
 
+class chess(commands.Cog):
+    """For commands related to the chess bot."""
 
-def parse(c):
-    fil, rank = ord(c[0]) - ord("a"), int(c[1]) - 1
-    return A1 + fil - 10 * rank
+    def __init__(self, bot: commands.Bot) -> None:
+        self.bot = bot
+        # The player of each running game keyed by channel id
+        self.games = {}
+        # The command task and engine worker of each running game
+        self.game_tasks = {}
+        self.engines = [
+            ProcessPoolExecutor(max_workers=1) for _ in range(ENGINE_WORKERS)
+        ]
+        self.engine_games = [0] * ENGINE_WORKERS
+        book.load()
+
+    def cog_unload(self):
+        # Running games are stopped and their searchers freed before the
+        # engines shut down, which finish the work already queued first
+        embed = discord.Embed(
+            color=discord.Color.blurple(), title="Game ended as chess was unloaded"
+        )
 
+        for game_id, (task, worker) in self.game_tasks.items():
+            task.cancel()
+            self.engines[worker].submit(end_game, game_id)
 
-def render(i):
-    rank, fil = divmod(i - A1, 10)
-    return chr(fil + ord("a")) + str(-rank + 1)
+            if channel := self.bot.get_channel(game_id):
+                asyncio.create_task(channel.send(embed=embed))
 
+        self.games.clear()
+        self.game_tasks.clear()
 
-async def print_pos(ctx, pos):
-    uni_pieces = {
-        "r": "♜",
-        "n": "♞",
-        "b": "♝",
-        "q": "♛",
-        "k": "♚",
-        "p": "♟",
-        "R": "♖",
-        "N": "♘",
-        "B": "♗",
-        "Q": "♕",
-        "K": "♔",
-        "P": "♙",
-        ".": "\u2004\u2004\u2005",
-    }
-    msg = ""
-    for i, row in enumerate(pos.board.split()):
-        msg += f"{''.join(uni_pieces.get(p, p) for p in row)}\n"
-
-    background = Image.open("fonts/chess.png")
-    img = Image.new("RGBA", (1024, 1050), (255, 0, 0, 0))
-
-    d = ImageDraw.Draw(img)
-    font = ImageFont.truetype("fonts/DejaVuSans.ttf", 135)
-    d.text((40, 0), msg, font=font, fill=(0, 0, 0), spacing=4)
-    background.paste(img, (0, 0), img)
-
-    with io.BytesIO() as image_binary:
-        background.save(image_binary, "PNG")
-        image_binary.seek(0)
-        return await ctx.send(file=discord.File(fp=image_binary, filename="image.png"))
+        for engine in self.engines:
+            engine.shutdown(wait=False)
 
+    def is_playing(self, message):
+        """Returns whether a message was sent by a player in their games channel.
 
-class chess(commands.Cog):
-    """For commands related to the chess bot."""
+        message: discord.Message
+        """
+        return self.games.get(message.channel.id) == message.author.id
 
-    def __init__(self, bot: commands.Bot) -> None:
-        self.bot = bot
-        self.is_running = False
+    @commands.command(hidden=True)
+    async def chess(self, ctx, level: int = 3):
+        """Starts a game of chess against an bot.
 
-    @staticmethod
-    def cog_unload():
-        DB.db.delete(b"playing_chess")
+        level: int
+            How strong the bot is from 1 to 5.
+        """
+        embed = discord.Embed(color=discord.Color.blurple())
 
-    @commands.command(hidden=True)
-    async def chess(self, ctx):
-        """Starts a game of chess against an bot."""
-        if self.is_running is True:
-            return await ctx.send(
-                embed=discord.Embed(
-                    color=discord.Color.blurple(),
-                    description="```A game is already running```",
-                )
+        if ctx.channel.id in self.games:
+            embed.description = "```A game is already running in this channel```"
+            return await ctx.send(embed=embed)
+
+        if ctx.author.id in self.games.values():
+            embed.description = "```You are already playing a game```"
+            return await ctx.send(embed=embed)
+
+        if len(self.games) >= MAX_GAMES:
+            embed.description = "```Too many games are running, try again soon```"
+            return await ctx.send(embed=embed)
+
+        if level not in LEVELS:
+            embed.description = f"```Level must be from 1 to {len(LEVELS)}```"
+            return await ctx.send(embed=embed)
+
+        game_id = ctx.channel.id
+        worker = self.engine_games.index(min(self.engine_games))
+        self.engine_games[worker] += 1
+        engine = self.engines[worker]
+        loop = asyncio.get_running_loop()
+
+        self.games[game_id] = ctx.author.id
+        self.game_tasks[game_id] = asyncio.current_task(), worker
+
+        try:
+            await loop.run_in_executor(engine, new_game, game_id)
+            try:
+                await self.play(ctx, engine, game_id, level)
+            finally:
+                # Games still running when the cog unloads are ended there
+                if game_id in self.games:
+                    stats = await loop.run_in_executor(engine, end_game, game_id)
+        finally:
+            if self.games.pop(game_id, None):
+                del self.game_tasks[game_id]
+                self.engine_games[worker] -= 1
+
+        embed.description = "```Transposition tables\n\n{}```".format(
+            "\n".join(
+                f"{name.title()}: {table['hit_rate']:.0%} hit rate,"
+                f" {table['filled']:.0%} full"
+                for name, table in stats.items()
             )
+        )
+        await ctx.send(embed=embed)
 
-        self.is_running = True
-
-        # To stop logging of messages while playing chess cause it is spamy
-        DB.db.put(b"playing_chess", str(ctx.author.id).encode())
+    @staticmethod
+    async def play(ctx, engine, game_id, level):
+        """Plays a game of chess until it ends.
 
+        engine: concurrent.futures.ProcessPoolExecutor
+            The worker process running the games engine.
+        game_id: int
+        level: int
+        """
         embed = discord.Embed(color=discord.Color.blurple())
         chess_message = None
 
         hist = [Position(initial, 0, (True, True), (True, True), 0, 0)]
-        searcher = Searcher()
 
         def check(message: discord.Message) -> bool:
             return message.author.id == ctx.author.id and message.channel == ctx.channel
@@ -457,10 +196,8 @@ class chess(commands.Cog):
                         "message", timeout=300.0, check=check
                     )
                 except asyncio.TimeoutError:
-                    self.is_running = False
-                    DB.db.delete(b"playing_chess")
                     embed.title = "Game timed out"
-                    await ctx.send(embed=embed)
+                    return await ctx.send(embed=embed)
 
                 if message.content.lower() == "surrender":
                     await message.delete()
@@ -480,20 +217,15 @@ class chess(commands.Cog):
                 embed.title = "You won"
                 return await ctx.send(embed=embed)
 
-            start = time.time()
-            for _depth, move, score in searcher.search(hist[-1], hist):
-                if time.time() - start > 0.3:
-                    if score == MATE_UPPER:
-                        embed.title = "Checkmate!"
-                        return await ctx.send(embed=embed)
-                    break
+            move, score = await engine_move(engine, game_id, hist, level)
+
+            if score == MATE_UPPER:
+                embed.title = "Checkmate!"
+                return await ctx.send(embed=embed)
 
             hist.append(hist[-1].move(move))
-        self.is_running = False
-        DB.db.delete(b"playing_chess")
 
 
 def setup(bot: commands.Bot) -> None:
     """Starts the chess cog."""
-    DB.db.delete(b"playing_chess")
     bot.add_cog(chess(bot))
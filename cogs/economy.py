@@ -426,6 +426,9 @@ class economy(commands.Cog):
         embed = discord.Embed(color=discord.Color.blurple())
         embed.add_field(name=f"{user.display_name}'s balance", value=f"${bal:,}")
 
+        if rank := await DB.get_rank(user_id):
+            embed.set_footer(text=f"Rank: #{rank:,}")
+
         await ctx.send(embed=embed)
 
     @commands.command(aliases=["give", "donate"])
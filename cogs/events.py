@@ -1,20 +1,32 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 import orjson
 import platform
 import os
 from datetime import datetime
 import psutil
 import logging
-from PIL import Image
-from io import BytesIO
 import difflib
 import cogs.utils.database as DB
+import cogs.utils.http as http
+import cogs.utils.images as images
+import cogs.utils.scheduler as scheduler
 
 
 class events(commands.Cog):
     def __init__(self, bot: commands.Bot) -> None:
         self.bot = bot
+        self.flush_message_counts.start()
+
+    def cog_unload(self):
+        """Writes any buffered message counts when the cog is unloaded."""
+        self.flush_message_counts.cancel()
+        DB.flush_message_counts()
+
+    @tasks.loop(seconds=30)
+    async def flush_message_counts(self):
+        """Writes buffered message counts to the db every 30 seconds."""
+        DB.flush_message_counts()
 
     async def poll_check(self, payload):
         """Keeps track of poll results.
@@ -76,14 +88,9 @@ class events(commands.Cog):
         if len(emojis[message_id]["users"]) >= 8:
             channel = self.bot.get_channel(payload.channel_id)
             message = await channel.fetch_message(payload.message_id)
-            file = message.attachments[0]
-            file = BytesIO(await file.read())
-            file = Image.open(file)
-            file.thumbnail((256, 256), Image.LANCZOS)
-
-            imgByteArr = BytesIO()
-            file.save(imgByteArr, format="PNG")
-            file = imgByteArr.getvalue()
+            file = await images.run(
+                images.make_emoji, await message.attachments[0].read()
+            )
 
             name = emojis[message_id]["name"]
 
@@ -290,10 +297,14 @@ class events(commands.Cog):
 
         message: discord.Message
         """
+        # Moves are deleted as chess is played which would spam the logs
+        chess = self.bot.get_cog("chess")
+
         if (
             not message.guild
             or DB.db.get(f"{message.guild.id}-logging".encode())
-            or DB.db.get(b"playing_chess")
+            or chess
+            and chess.is_playing(message)
             or message.author == self.bot.user
             or not message.content
             and not message.attachments
@@ -335,6 +346,7 @@ class events(commands.Cog):
                 DB.blacklist.put(
                     f"{message.guild.id}-{message.author.id}".encode(), b"1"
                 )
+                scheduler.cancel(f"downvote-{message.guild.id}-{message.author.id}")
 
         channel = discord.utils.get(message.guild.channels, name="logs")
 
@@ -357,16 +369,7 @@ class events(commands.Cog):
         """
         if message.guild:
             guild = message.guild.id
-
-            key = f"{guild}-{message.author.id}".encode()
-            count = DB.message_count.get(key)
-
-            if count:
-                count = int(count) + 1
-            else:
-                count = 1
-
-            DB.message_count.put(key, str(count).encode())
+            DB.add_message_count(guild, message.author.id)
         else:
             guild = None
 
@@ -450,10 +453,10 @@ class events(commands.Cog):
             uses = DB.invites.get(key.encode())
 
             if not uses:
-                DB.invites.put(key.encode(), str(invite.uses).encode())
+                DB.invites.put(key.encode(), DB.pack_int(invite.uses))
                 continue
 
-            if invite.uses > int(uses):
+            if invite.uses > DB.unpack_int(uses):
                 DB.invites.put(str(member.id).encode(), invite.code.encode())
 
     @commands.Cog.listener()
@@ -481,7 +484,7 @@ class events(commands.Cog):
         invite: discord.Invite
         """
         key = f"{invite.code}-{invite.guild.id}"
-        DB.invites.put(key.encode(), str(invite.uses).encode())
+        DB.invites.put(key.encode(), DB.pack_int(invite.uses))
 
     @commands.Cog.listener()
     async def on_invite_delete(self, invite):
@@ -541,6 +544,12 @@ class events(commands.Cog):
                 cooldown // 3600, (cooldown % 3600) // 60, (cooldown % 3600) % 60
             )
 
+        elif isinstance(error, http.RateLimited):
+            message = f"Too many requests to {error.host}. Try again in {error.retry_after:.1f} seconds."
+
+        elif isinstance(error, images.QueueFull):
+            message = str(error)
+
         elif isinstance(error, discord.Forbidden):
             message = "I do not have the required permissions to run this command."
 
@@ -597,9 +606,8 @@ class events(commands.Cog):
             boot_times.append(round(boot_time, 5))
             DB.db.put(b"boot_times", orjson.dumps(boot_times))
 
-            # Wipe the cache and polls as we have no way of knowing if it has expired
-            DB.db.put(b"cache", b"{}")
-            DB.db.delete(b"polls")
+            # Timers that became due while the bot was offline run now
+            scheduler.start()
 
             print(
                 f"Logged in as {self.bot.user.name}\n"
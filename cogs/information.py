@@ -51,14 +51,8 @@ class information(commands.Cog):
         """
         amount = max(0, min(50, amount))
 
-        msgtop = sorted(
-            [
-                (int(b), m.decode())
-                for m, b in DB.message_count
-                if int(m.decode().split("-")[0]) == ctx.guild.id
-            ],
-            reverse=True,
-        )[:amount]
+        counts = await DB.get_message_counts(ctx.guild.id)
+        msgtop = sorted(counts, reverse=True)[:amount]
 
         embed = discord.Embed(color=discord.Color.blurple())
         result = []
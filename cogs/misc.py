@@ -6,8 +6,8 @@ import lxml.html
 import orjson
 import re
 import cogs.utils.database as DB
+import cogs.utils.images as images
 import config
-from PIL import Image, ImageDraw, ImageFont
 from io import BytesIO
 
 
@@ -39,18 +39,13 @@ class misc(commands.Cog):
         """This person doesn't exist."""
         url = "https://thispersondoesnotexist.com/image"
 
-        async with ctx.typing(), aiohttp.ClientSession() as session, session.get(
-            url
-        ) as response:
+        async with ctx.typing(), self.bot.client_session.get(url) as response:
             with BytesIO((await response.read())) as image_binary:
                 image_binary.seek(0)
                 await ctx.send(file=discord.File(fp=image_binary, filename="image.png"))
 
     @staticmethod
     async def visualize_predictions(image, predictions):
-        img = Image.open(BytesIO(await image.read()))
-        img = img.convert("RGBA")
-
         labels = {prediction["label"] for prediction in predictions}
         colors = {
             label: (
@@ -61,37 +56,9 @@ class misc(commands.Cog):
             for label in labels
         }
 
-        for prediction in predictions:
-            bounding_boxes = (
-                prediction["bbox"]["x1"],
-                prediction["bbox"]["y1"],
-                prediction["bbox"]["x2"],
-                prediction["bbox"]["y2"],
-            )
-            label = prediction["label"]
-            color = colors[label]
-
-            x1, y1, x2, y2 = bounding_boxes
-            mask = Image.new("RGBA", img.size, color + (0,))
-            draw = ImageDraw.Draw(mask)
-
-            font = ImageFont.truetype(r"fonts\DejaVuSans.ttf", round(img.width / 25))
-            text_x, text_y = font.getsize(label)
-
-            draw.rectangle(((x1, y1), (x2, y2)), fill=color + (96,))
-            if (y1 - text_y) > 0 and x1 > 0 and x2 > 0:
-                draw.rectangle(
-                    ((x1, y1), (x1 + text_x, y1 - text_y)), fill=color + (96,)
-                )
-            else:
-                text_y = 0
-
-            draw.text((x1, y1 - text_y), text=label, fill="white", font=font)
-            img = Image.alpha_composite(img, mask)
-
-        img = img.convert("RGB")
-
-        return img
+        return await images.run(
+            images.draw_predictions, await image.read(), predictions, colors
+        )
 
     @commands.command(name="vision")
     async def machine_vision(self, ctx):
@@ -113,7 +80,7 @@ class misc(commands.Cog):
         )
 
         async with ctx.typing():
-            async with aiohttp.ClientSession() as session, session.post(
+            async with self.bot.client_session.post(
                 "https://api.openvisionapi.com/api/v1/detection",
                 data=form,
             ) as response:
@@ -134,9 +101,7 @@ class misc(commands.Cog):
 
             img = await self.visualize_predictions(image, data["predictions"])
 
-            with BytesIO() as image_binary:
-                img.save(image_binary, "PNG")
-                image_binary.seek(0)
+            with BytesIO(img) as image_binary:
                 await ctx.send(file=discord.File(fp=image_binary, filename="image.png"))
 
     @commands.command()
@@ -254,9 +219,10 @@ class misc(commands.Cog):
             "target_application_id": 755600276941176913,
         }
 
-        async with aiohttp.ClientSession(headers=headers) as session, session.post(
+        async with self.bot.client_session.post(
             f"https://discord.com/api/v9/channels/{ctx.author.voice.channel.id}/invites",
             json=json,
+            headers=headers,
         ) as response:
             data = await response.json()
 
@@ -293,9 +259,10 @@ class misc(commands.Cog):
             "target_application_id": 755827207812677713,
         }
 
-        async with aiohttp.ClientSession(headers=headers) as session, session.post(
+        async with self.bot.client_session.post(
             f"https://discord.com/api/v9/channels/{ctx.author.voice.channel.id}/invites",
             json=json,
+            headers=headers,
         ) as response:
             data = await response.json()
 
@@ -332,9 +299,10 @@ class misc(commands.Cog):
             "target_application_id": 773336526917861400,
         }
 
-        async with aiohttp.ClientSession(headers=headers) as session, session.post(
+        async with self.bot.client_session.post(
             f"https://discord.com/api/v9/channels/{ctx.author.voice.channel.id}/invites",
             json=json,
+            headers=headers,
         ) as response:
             data = await response.json()
 
@@ -371,9 +339,10 @@ class misc(commands.Cog):
             "target_application_id": 814288819477020702,
         }
 
-        async with aiohttp.ClientSession(headers=headers) as session, session.post(
+        async with self.bot.client_session.post(
             f"https://discord.com/api/v9/channels/{ctx.author.voice.channel.id}/invites",
             json=json,
+            headers=headers,
         ) as response:
             data = await response.json()
 
@@ -400,7 +369,7 @@ class misc(commands.Cog):
         DB.db.put(b"rps", history if history else b"" + choice.encode())
 
         url = f"https://smartplay.afiniti.com/v1/play/{str(history)}"
-        async with aiohttp.ClientSession() as session, session.get(url) as page:
+        async with self.bot.client_session.get(url) as page:
             result = await page.json()
 
         result = ("tied", "won", "lost")[
@@ -487,15 +456,9 @@ class misc(commands.Cog):
             The user to get the karma of.
         """
         user = user or ctx.author
-        user_id = str(user.id).encode()
-        karma = DB.karma.get(user_id)
-
-        if not karma:
-            karma = 0
-        else:
-            karma = karma.decode()
+        karma = await DB.get_karma(user.id)
 
-        tenary = "+" if int(karma) > 0 else ""
+        tenary = "+" if karma > 0 else ""
 
         embed = discord.Embed(color=discord.Color.blurple())
         embed.description = f"```diff\n{user.display_name}'s karma:\n{tenary}{karma}```"
@@ -504,7 +467,7 @@ class misc(commands.Cog):
     @commands.command(aliases=["kboard", "karmab", "karmatop"])
     async def karmaboard(self, ctx):
         """Displays the top 5 and bottom 5 members karma."""
-        sorted_karma = sorted([(int(k), int(m)) for m, k in DB.karma], reverse=True)
+        sorted_karma = await DB.get_karmas()
         embed = discord.Embed(title="Karma Board", color=discord.Color.blurple())
 
         def parse_karma(data):
@@ -537,9 +500,9 @@ class misc(commands.Cog):
 
         async with ctx.typing():
             try:
-                async with aiohttp.ClientSession(
-                    raise_for_status=True
-                ) as session, session.get(url) as page:
+                async with self.bot.client_session.get(
+                    url, raise_for_status=True
+                ) as page:
                     text = lxml.html.fromstring(await page.text())
             except aiohttp.client_exceptions.ClientResponseError:
                 embed.description = f"```Could not find and element with the symbol {element.upper()}```"
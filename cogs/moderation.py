@@ -1,7 +1,7 @@
 from discord.ext import commands, menus
 import discord
-import asyncio
 import cogs.utils.database as DB
+import cogs.utils.scheduler as scheduler
 import orjson
 
 
@@ -20,11 +20,20 @@ class moderation(commands.Cog):
 
     def __init__(self, bot: commands.Bot) -> None:
         self.bot = bot
-        self.loop = asyncio.get_event_loop()
+        scheduler.register("end_poll", self.end_poll)
+        scheduler.register("unban", self.unban)
 
-    @staticmethod
-    async def end_poll(guild, message):
-        """Ends a poll and sends the results."""
+    def cog_unload(self):
+        """Stops running poll and unban timers while the cog is unloaded."""
+        scheduler.unregister("end_poll")
+        scheduler.unregister("unban")
+
+    async def end_poll(self, channel_id, message_id):
+        """Ends a poll and sends the results.
+
+        channel_id: int
+        message_id: int
+        """
         polls = DB.db.get(b"polls")
 
         if not polls:
@@ -32,16 +41,36 @@ class moderation(commands.Cog):
 
         polls = orjson.loads(polls)
 
-        message_id = str(message.id)
-        winner = max(
-            polls[guild][message_id], key=lambda x: polls[guild][message_id][x]["count"]
-        )
+        channel = self.bot.get_channel(channel_id)
+        guild = str(channel.guild.id)
 
-        await message.reply(f"Winner of the poll was {winner}")
+        if str(message_id) not in polls.get(guild, {}):
+            return
 
-        polls[guild].pop(message_id)
+        poll = polls[guild].pop(str(message_id))
         DB.db.put(b"polls", orjson.dumps(polls))
 
+        winner = max(poll, key=lambda x: poll[x]["count"])
+        message = await channel.fetch_message(message_id)
+        await message.reply(f"Winner of the poll was {winner}")
+
+    async def unban(self, guild_id, member_id):
+        """Unbans a member when their ban ends.
+
+        guild_id: int
+        member_id: int
+        """
+        await self.bot.get_guild(guild_id).unban(discord.Object(id=member_id))
+
+    @commands.Cog.listener()
+    async def on_member_unban(self, guild, user):
+        """Cancels the timer of a temporary ban when a member is unbanned early.
+
+        guild: discord.Guild
+        user: discord.User
+        """
+        scheduler.cancel(f"unban-{guild.id}-{user.id}")
+
     @commands.command()
     async def poll(self, ctx, name, *options):
         """Starts a poll.
@@ -89,7 +118,9 @@ class moderation(commands.Cog):
             await message.add_reaction(f"{i}️⃣")
 
         DB.db.put(b"polls", orjson.dumps(polls))
-        self.loop.call_later(21600, asyncio.create_task, self.end_poll(guild, message))
+        scheduler.schedule(
+            21600, "end_poll", ctx.channel.id, message.id, name=f"poll-{message.id}"
+        )
 
     @commands.command(name="mute")
     @commands.has_permissions(kick_members=True)
@@ -274,6 +305,9 @@ class moderation(commands.Cog):
             embed.description = "```You can't ban someone higher or equal to you```"
             return await ctx.send(embed=embed)
 
+        # Replaces the timer of any earlier temporary ban
+        timer = f"unban-{ctx.guild.id}-{member.id}"
+
         if duration:
             seconds = await self.end_date(duration)
 
@@ -281,9 +315,10 @@ class moderation(commands.Cog):
                 embed.description = "```Invalid duration. Example: '3d 5h 10m'```"
                 return await ctx.send(embed=embed)
 
-            self.loop.call_later(seconds, asyncio.create_task, ctx.guild.unban(member))
+            scheduler.schedule(seconds, "unban", ctx.guild.id, member.id, name=timer)
             embed.title = f"Banned {member.display_name} for {seconds}s"
         else:
+            scheduler.cancel(timer)
             embed.title = f"Banned {member.display_name}"
 
         await member.ban(reason=reason)
@@ -10,6 +10,8 @@ import subprocess
 import re
 import logging
 import cogs.utils.database as DB
+import cogs.utils.http as http
+import cogs.utils.cache as cache
 
 
 class PerformanceMocker:
@@ -213,8 +215,59 @@ class owner(commands.Cog):
         embed.description = f"```{msg}```"
         await ctx.send(embed=embed)
 
-    @commands.group()
-    async def cache(self, ctx):
+    @commands.command(name="http")
+    async def http_stats(self, ctx):
+        """Shows request, connection and rate limit stats for each host."""
+        embed = discord.Embed(color=discord.Color.blurple())
+
+        if not http.stats:
+            embed.description = "```No requests have been made```"
+            return await ctx.send(embed=embed)
+
+        msg = ""
+
+        for host, stats in sorted(
+            http.stats.items(), key=lambda item: item[1]["requests"], reverse=True
+        ):
+            requests = stats["requests"] or 1
+            msg += (
+                f"{host}\n"
+                f"  Requests: {stats['requests']:,} Errors: {stats['errors']:,}"
+                f" Latency: {stats['latency'] / requests * 1000:.0f}ms"
+                f" Reused: {stats['reused'] / requests:.0%}"
+                f" Coalesced: {stats['coalesced']:,}\n"
+                f"  Queued: {http.buckets[host].waiting:,}"
+                f" Waited: {stats['waited'] / requests:.2f}s"
+                f" 429s: {stats['rate_limited']:,}"
+                f" Rejected: {stats['rejected']:,}\n"
+            )
+
+        embed.description = f"```{msg[:2000]}```"
+        await ctx.send(embed=embed)
+
+    @commands.command()
+    async def pools(self, ctx):
+        """Shows the size and hit rate of the prefetched image pools."""
+        embed = discord.Embed(color=discord.Color.blurple())
+
+        if not (cog := self.bot.get_cog("apis")):
+            embed.description = "```The apis cog isn't loaded```"
+            return await ctx.send(embed=embed)
+
+        msg = f"{'Pool':<10} Size  Hits  Misses  Hit Rate\n"
+
+        for name, pool in cog.pools.items():
+            requests = pool.hits + pool.misses
+            msg += (
+                f"{name:<10} {len(pool.urls):>4} {pool.hits:>5,} {pool.misses:>7,}"
+                f" {pool.hits / (requests or 1):>9.0%}\n"
+            )
+
+        embed.description = f"```{msg}```"
+        await ctx.send(embed=embed)
+
+    @commands.group(name="cache")
+    async def cache_group(self, ctx):
         """Command group for interacting with the cache."""
         if not ctx.invoked_subcommand:
             await ctx.send(
@@ -224,10 +277,10 @@ class owner(commands.Cog):
                 )
             )
 
-    @cache.command()
+    @cache_group.command()
     async def wipe(self, ctx):
-        """Wipes cache from the db."""
-        DB.db.delete(b"cache")
+        """Wipes the cache."""
+        cache.wipe()
 
         await ctx.send(
             embed=discord.Embed(
@@ -235,23 +288,25 @@ class owner(commands.Cog):
             )
         )
 
-    @cache.command()
+    @cache_group.command()
     async def list(self, ctx):
-        """Lists the cached items in the db."""
+        """Lists the cached items and the hits and misses of each namespace."""
         embed = discord.Embed(color=discord.Color.blurple())
-        cache = DB.db.get(b"cache")
 
-        if not cache or cache == b"{}":
-            embed.description = "```Nothing has been cached```"
-            return await ctx.send(embed=embed)
+        msg = f"{'Namespace':<10} Hits  Misses  Evicted  Expired\n"
+        for namespace, stats in sorted(cache.stats.items()):
+            msg += (
+                f"{namespace:<10} {stats['hits']:>4,} {stats['misses']:>7,}"
+                f" {stats['evictions']:>8,} {stats['expired']:>8,}\n"
+            )
 
-        cache = orjson.loads(cache)
-        msg = []
+        entries = cache.entries()
+        msg += f"\n{len(entries):,} items using {cache.size() / 1024:,.1f}KiB\n"
 
-        for item in cache:
-            msg.append(item)
+        for namespace, key, ttl, size in entries:
+            msg += f"\n{namespace}-{key[:30]} {ttl:.0f}s {size / 1024:,.1f}KiB"
 
-        embed.description = "```{}```".format("\n".join(msg))
+        embed.description = f"```{msg[:2000]}```"
         await ctx.send(embed=embed)
 
     @commands.command()
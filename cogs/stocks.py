@@ -2,7 +2,9 @@ import discord
 from discord.ext import commands, menus
 import orjson
 import textwrap
+from io import BytesIO
 import cogs.utils.database as DB
+import cogs.utils.charts as charts
 
 
 class StockMenu(menus.ListPageSource):
@@ -21,6 +23,64 @@ class stocks(commands.Cog):
     def __init__(self, bot: commands.Bot) -> None:
         self.bot = bot
 
+    @staticmethod
+    async def send_with_chart(ctx, embed, kind, symbol):
+        """Sends an embed with a chart of the last day of a symbols price.
+
+        The embed is sent without a chart if there isn't any price history.
+
+        kind: str
+            Either stocks or crypto.
+        symbol: str
+        """
+        chart = await charts.get_chart(kind, symbol)
+
+        if not chart:
+            return await ctx.send(embed=embed)
+
+        embed.set_image(url="attachment://chart.png")
+        await ctx.send(embed=embed, file=discord.File(BytesIO(chart), "chart.png"))
+
+    @commands.command()
+    async def chart(self, ctx, symbol, days: float = 1, style="line"):
+        """Shows a chart of the price history of a stock or crypto.
+
+        symbol: str
+            The symbol of the stock or crypto.
+        days: float
+            How many days of history to show.
+        style: str
+            Either line or candle.
+        """
+        symbol = symbol.upper()
+        embed = discord.Embed(color=discord.Color.blurple())
+
+        # Also rejects nan which fails every comparison
+        if not 0 < days <= DB.HISTORY_RETENTION_DAYS:
+            embed.description = (
+                "```Days must be more than 0 and at most"
+                f" {DB.HISTORY_RETENTION_DAYS}```"
+            )
+            return await ctx.send(embed=embed)
+
+        if await DB.get_stock(symbol):
+            kind = "stocks"
+        elif await DB.get_crypto(symbol):
+            kind = "crypto"
+        else:
+            embed.description = f"```Couldn't find {symbol}```"
+            return await ctx.send(embed=embed)
+
+        chart = await charts.get_chart(kind, symbol, days * 86400, style)
+
+        if not chart:
+            embed.description = f"```No price history for {symbol} yet```"
+            return await ctx.send(embed=embed)
+
+        embed.title = f"{symbol} over {days:g} days"
+        embed.set_image(url="attachment://chart.png")
+        await ctx.send(embed=embed, file=discord.File(BytesIO(chart), "chart.png"))
+
     @commands.command(name="stocks")
     async def get_stocks(self, ctx):
         """Shows the price of stocks from yahoo finance."""
@@ -49,28 +109,22 @@ class stocks(commands.Cog):
         """
         symbol = symbol.upper()
         member_id = str(ctx.author.id).encode()
-        stockbal = await DB.get_stockbal(member_id)
+        holding = await DB.get_position("stocks", member_id, symbol)
         embed = discord.Embed(color=discord.Color.blurple())
 
-        if not stockbal:
-            embed.description = "```You have never invested```"
-            return await ctx.send(embed=embed)
-
-        if symbol not in stockbal:
+        if not holding:
             embed.description = f"```You have never invested in {symbol}```"
             return await ctx.send(embed=embed)
 
         stock = await DB.get_stock(symbol)
 
-        trades = [
-            trade[1] / trade[0] for trade in stockbal[symbol]["history"] if trade[0] > 0
-        ]
-        change = ((float(stock["price"]) / (sum(trades) / len(trades))) - 1) * 100
+        average = holding["cash"] / holding["units"]
+        change = ((float(stock["price"]) / average) - 1) * 100
 
         embed.description = textwrap.dedent(
             f"""
                 ```diff
-                You have {stockbal[symbol]['total']:.2f} stocks in {symbol}
+                You have {holding['total']:.2f} stocks in {symbol}
 
                 Price: {stock['price']}
 
@@ -94,7 +148,7 @@ class stocks(commands.Cog):
         member = member or ctx.author
 
         member_id = str(member.id).encode()
-        stockbal = await DB.get_stockbal(member_id)
+        stockbal = await DB.get_holdings("stocks", member_id)
         embed = discord.Embed(color=discord.Color.blurple())
 
         if not stockbal:
@@ -115,12 +169,8 @@ class stocks(commands.Cog):
             data = await DB.get_stock(stock)
             price = float(data["price"])
 
-            trades = [
-                trade[1] / trade[0]
-                for trade in stockbal[stock]["history"]
-                if trade[0] > 0
-            ]
-            change = ((price / (sum(trades) / len(trades))) - 1) * 100
+            average = stockbal[stock]["cash"] / stockbal[stock]["units"]
+            change = ((price / average) - 1) * 100
             sign = "-" if str(change)[0] == "-" else "+"
 
             msg += f"{sign} {stock:>4}: {stockbal[stock]['total']:<14.2f}"
@@ -165,7 +215,7 @@ class stocks(commands.Cog):
             """
         )
 
-        await ctx.send(embed=embed)
+        await self.send_with_chart(ctx, embed, "stocks", symbol)
 
     @commands.command(name="sellstock", aliases=["sell"])
     async def sell_stock(self, ctx, symbol, amount: float):
@@ -191,30 +241,18 @@ class stocks(commands.Cog):
 
         price = price["price"]
         member_id = str(ctx.author.id).encode()
-        stockbal = await DB.get_stockbal(member_id)
+        holding = await DB.get_position("stocks", member_id, symbol)
 
-        if not stockbal:
+        if not holding:
             embed.description = f"```You have never invested in {symbol}```"
             return await ctx.send(embed=embed)
 
-        if stockbal[symbol]["total"] < amount:
-            embed.description = (
-                f"```Not enough stock you have: {stockbal[symbol]['total']}```"
-            )
+        if holding["total"] < amount:
+            embed.description = f"```Not enough stock you have: {holding['total']}```"
             return await ctx.send(embed=embed)
 
-        bal = await DB.get_bal(member_id)
-
         cash = amount * float(price)
-
-        stockbal[symbol]["total"] -= amount
-
-        if stockbal[symbol]["total"] == 0:
-            stockbal.pop(symbol, None)
-        else:
-            stockbal[symbol]["history"].append((-amount, cash))
-
-        bal += cash
+        bal = await DB.trade("stocks", member_id, symbol, -amount, cash)
 
         embed = discord.Embed(
             title=f"Sold {amount:.2f} stocks for ${cash:.2f}",
@@ -224,9 +262,6 @@ class stocks(commands.Cog):
 
         await ctx.send(embed=embed)
 
-        await DB.put_bal(member_id, bal)
-        await DB.put_stockbal(member_id, stockbal)
-
     @commands.command(aliases=["buy"])
     async def invest(self, ctx, symbol, cash: float):
         """Buys stock or if nothing is passed in it shows the price of some stocks.
@@ -257,16 +292,7 @@ class stocks(commands.Cog):
             return await ctx.send(embed=embed)
 
         amount = cash / float(stock)
-
-        stockbal = await DB.get_stockbal(member_id)
-
-        if symbol not in stockbal:
-            stockbal[symbol] = {"total": 0, "history": [(amount, cash)]}
-        else:
-            stockbal[symbol]["history"].append((amount, cash))
-
-        stockbal[symbol]["total"] += amount
-        bal -= cash
+        bal = await DB.trade("stocks", member_id, symbol, amount, cash)
 
         embed = discord.Embed(
             title=f"You bought {amount:.2f} stocks in {symbol}",
@@ -276,9 +302,6 @@ class stocks(commands.Cog):
 
         await ctx.send(embed=embed)
 
-        await DB.put_bal(member_id, bal)
-        await DB.put_stockbal(member_id, stockbal)
-
     @commands.command(name="nettop")
     async def top_net_worths(self, ctx, amount: int = 10):
         """Gets members with the highest net worth
@@ -286,32 +309,15 @@ class stocks(commands.Cog):
         amount: int
             The amount of members to get
         """
-
-        def get_value(values, db):
-            if values:
-                return sum(
-                    [
-                        stock[1]["total"]
-                        * float(orjson.loads(db.get(stock[0].encode()))["price"])
-                        for stock in values.items()
-                    ]
-                )
-
-            return 0
-
         net_top = []
 
-        for member_id, value in DB.bal:
-            stock_value = get_value(await DB.get_stockbal(member_id), DB.stocks)
-            crypto_value = get_value(await DB.get_cryptobal(member_id), DB.crypto)
-            # fmt: off
-            if (member := self.bot.get_user(int(member_id))):
-                net_top.append(
-                    (float(value) + stock_value + crypto_value, member.display_name)
-                )
-            # fmt: on
+        for value, member_id in await DB.get_nettop():
+            if len(net_top) >= amount:
+                break
+
+            if member := self.bot.get_user(member_id):
+                net_top.append((value, member.display_name))
 
-        net_top = sorted(net_top, reverse=True)[:amount]
         embed = discord.Embed(color=discord.Color.blurple())
 
         embed.title = f"Top {len(net_top)} Richest Members"
@@ -346,8 +352,8 @@ class stocks(commands.Cog):
 
             return 0
 
-        stock_value = get_value(await DB.get_stockbal(member_id), DB.stocks)
-        crypto_value = get_value(await DB.get_cryptobal(member_id), DB.crypto)
+        stock_value = get_value(await DB.get_holdings("stocks", member_id), DB.stocks)
+        crypto_value = get_value(await DB.get_holdings("crypto", member_id), DB.crypto)
 
         embed.add_field(
             name=f"{member.display_name}'s net worth",
@@ -411,11 +417,8 @@ class stocks(commands.Cog):
                 ```
             """
         )
-        embed.set_image(
-            url=f"https://s3.coinmarketcap.com/generated/sparklines/web/1d/usd/{crypto['id']}.png"
-        )
 
-        await ctx.send(embed=embed)
+        await self.send_with_chart(ctx, embed, "crypto", symbol)
 
     @crypto.command(aliases=["b"])
     async def buy(self, ctx, symbol: str, cash: float):
@@ -448,16 +451,7 @@ class stocks(commands.Cog):
             return await ctx.send(embed=embed)
 
         amount = cash / price
-
-        cryptobal = await DB.get_cryptobal(member_id)
-
-        if symbol not in cryptobal:
-            cryptobal[symbol] = {"total": 0, "history": [(amount, cash)]}
-        else:
-            cryptobal[symbol]["history"].append((amount, cash))
-
-        cryptobal[symbol]["total"] += amount
-        bal -= cash
+        bal = await DB.trade("crypto", member_id, symbol, amount, cash)
 
         embed = discord.Embed(
             title=f"You bought {amount:.2f} {data['name']}",
@@ -467,9 +461,6 @@ class stocks(commands.Cog):
 
         await ctx.send(embed=embed)
 
-        await DB.put_bal(member_id, bal)
-        await DB.put_cryptobal(member_id, cryptobal)
-
     @crypto.command(aliases=["s"])
     async def sell(self, ctx, symbol, amount: float):
         """Sells crypto.
@@ -494,42 +485,26 @@ class stocks(commands.Cog):
 
         price = price["price"]
         member_id = str(ctx.author.id).encode()
-        cryptobal = await DB.get_cryptobal(member_id)
-
-        if not cryptobal:
-            embed.description = "```You haven't invested.```"
-            return await ctx.send(embed=embed)
+        holding = await DB.get_position("crypto", member_id, symbol)
 
-        if symbol not in cryptobal:
+        if not holding:
             embed.description = f"```You haven't invested in {symbol}.```"
             return await ctx.send(embed=embed)
 
-        if cryptobal[symbol]["total"] < amount:
+        if holding["total"] < amount:
             embed.description = (
-                f"```Not enough {symbol} you have: {cryptobal[symbol]['total']}```"
+                f"```Not enough {symbol} you have: {holding['total']}```"
             )
             return await ctx.send(embed=embed)
 
-        bal = await DB.get_bal(member_id)
         cash = amount * float(price)
-
-        cryptobal[symbol]["total"] -= amount
-
-        if cryptobal[symbol]["total"] == 0:
-            cryptobal.pop(symbol, None)
-        else:
-            cryptobal[symbol]["history"].append((-amount, cash))
-
-        bal += cash
+        bal = await DB.trade("crypto", member_id, symbol, -amount, cash)
 
         embed.title = f"Sold {amount:.2f} {symbol} for ${cash:.2f}"
         embed.set_footer(text=f"Balance: ${bal}")
 
         await ctx.send(embed=embed)
 
-        await DB.put_bal(member_id, bal)
-        await DB.put_cryptobal(member_id, cryptobal)
-
     @crypto.command(aliases=["p"])
     async def profile(self, ctx, member: discord.Member = None):
         """Gets someone's crypto profile.
@@ -540,7 +515,7 @@ class stocks(commands.Cog):
         member = member or ctx.author
 
         member_id = str(member.id).encode()
-        cryptobal = await DB.get_cryptobal(member_id)
+        cryptobal = await DB.get_holdings("crypto", member_id)
         embed = discord.Embed(color=discord.Color.blurple())
 
         if not cryptobal:
@@ -556,12 +531,8 @@ class stocks(commands.Cog):
         for crypto in cryptobal:
             data = await DB.get_crypto(crypto)
 
-            trades = [
-                trade[1] / trade[0]
-                for trade in cryptobal[crypto]["history"]
-                if trade[0] > 0
-            ]
-            change = ((data["price"] / (sum(trades) / len(trades))) - 1) * 100
+            average = cryptobal[crypto]["cash"] / cryptobal[crypto]["units"]
+            change = ((data["price"] / average) - 1) * 100
             sign = "-" if str(change)[0] == "-" else "+"
 
             msg += f"{sign} {crypto:>4}: {cryptobal[crypto]['total']:<14.2f}"
@@ -582,25 +553,17 @@ class stocks(commands.Cog):
         symbol = symbol.upper()
         member_id = str(ctx.author.id).encode()
 
-        cryptobal = await DB.get_cryptobal(member_id)
+        holding = await DB.get_position("crypto", member_id, symbol)
         embed = discord.Embed(color=discord.Color.blurple())
 
-        if not cryptobal:
-            embed.description = "```You haven't invested.```"
-            return await ctx.send(embed=embed)
-
-        if symbol not in cryptobal:
+        if not holding:
             embed.description = f"```You haven't invested in {symbol}```"
             return await ctx.send(embed=embed)
 
         crypto = await DB.get_crypto(symbol)
 
-        trades = [
-            trade[1] / trade[0]
-            for trade in cryptobal[symbol]["history"]
-            if trade[0] > 0
-        ]
-        change = ((crypto["price"] / (sum(trades) / len(trades))) - 1) * 100
+        average = holding["cash"] / holding["units"]
+        change = ((crypto["price"] / average) - 1) * 100
         sign = "" if str(crypto["change_24h"])[0] == "-" else "+"
 
         embed.set_author(
@@ -610,7 +573,7 @@ class stocks(commands.Cog):
         embed.description = textwrap.dedent(
             f"""
                 ```diff
-                Bal: {cryptobal[symbol]['total']}
+                Bal: {holding['total']}
 
                 Percent Gain/Loss:
                 {"" if str(change)[0] == "-" else "+"}{change:.2f}%
@@ -623,11 +586,8 @@ class stocks(commands.Cog):
                 ```
             """
         )
-        embed.set_image(
-            url=f"https://s3.coinmarketcap.com/generated/sparklines/web/1d/usd/{crypto['id']}.png"
-        )
 
-        await ctx.send(embed=embed)
+        await self.send_with_chart(ctx, embed, "crypto", symbol)
 
     @crypto.command()
     async def list(self, ctx):
@@ -654,12 +614,18 @@ class stocks(commands.Cog):
 
         member: discord.Member
         amount: int
-            How many transactions to get
+            How many transactions to get per crypto
         """
         member = member or ctx.author
+        member_id = str(member.id).encode()
 
         embed = discord.Embed(color=discord.Color.blurple())
-        cryptobal = await DB.get_cryptobal(str(member.id).encode())
+
+        if amount < 1:
+            embed.description = "```Amount must be at least 1```"
+            return await ctx.send(embed=embed)
+
+        cryptobal = await DB.get_holdings("crypto", member_id)
 
         if not cryptobal:
             embed.description = "```You haven't invested.```"
@@ -669,7 +635,7 @@ class stocks(commands.Cog):
 
         for crypto in cryptobal:
             msg += f"{crypto}:\n"
-            for trade in cryptobal[crypto]["history"]:
+            for trade in await DB.get_trades("crypto", member_id, crypto, amount):
                 if trade[0] < 0:
                     kind = "Sold"
                 else:
@@ -2,16 +2,21 @@ import discord
 from discord.ext import commands, menus
 import orjson
 import random
-import aiohttp
 import time
 import lxml.html
 import re
 import asyncio
 import cogs.utils.database as DB
+import cogs.utils.cache as cache
+import cogs.utils.http as http
 import ast
 import operator
 
 
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.67 Safari/537.36"
+}
+
 OPERATIONS = {
     ast.Add: operator.add,
     ast.Sub: operator.sub,
@@ -40,6 +45,20 @@ class useful(commands.Cog):
         self.bot = bot
         self.loop = asyncio.get_event_loop()
 
+    async def get_page(self, url):
+        """Gets and parses a page as a browser would see it.
+
+        Concurrent calls for the same url share one request.
+
+        url: str
+        """
+
+        async def fetch():
+            async with self.bot.client_session.get(url, headers=HEADERS) as page:
+                return await page.text()
+
+        return lxml.html.fromstring(await http.single_flight(url, fetch))
+
     @commands.command()
     async def weather(self, ctx, *, location):
         """Gets the weather from google.
@@ -51,13 +70,7 @@ class useful(commands.Cog):
         url = f"https://www.google.co.nz/search?q={location}+weather"
 
         async with ctx.typing():
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.67 Safari/537.36"
-            }
-            async with aiohttp.ClientSession(headers=headers) as session, session.get(
-                url
-            ) as page:
-                soup = lxml.html.fromstring(await page.text())
+            soup = await self.get_page(url)
 
             embed = discord.Embed(color=discord.Color.blurple())
             soup = soup.xpath('.//div[@class="nawv0d"]')
@@ -300,7 +313,7 @@ class useful(commands.Cog):
 
         data = {"language": lang, "source": code, "args": "", "stdin": "", "log": 0}
 
-        async with ctx.typing(), aiohttp.ClientSession() as session, session.post(
+        async with ctx.typing(), self.bot.client_session.post(
             "https://emkc.org/api/v1/piston/execute", data=orjson.dumps(data)
         ) as response:
             r = await response.json()
@@ -433,25 +446,25 @@ class useful(commands.Cog):
         )
         await message.delete()
 
-    async def cache_check(self, search):
+    @staticmethod
+    def cache_check(namespace, search):
         """Checks the cache for an search if found randomly return a result.
 
+        namespace: str
         search: str
         """
-        cache = orjson.loads(DB.db.get(b"cache"))
-
-        if search in cache:
-            if len(cache[search]) == 0:
-                return {}
+        if not (images := cache.get(namespace, search)):
+            return None
 
-            url, title = random.choice(list(cache[search].items()))
+        url, title = random.choice(list(images.items()))
+        images.pop(url)
 
-            cache[search].pop(url)
-
-            DB.db.put(b"cache", orjson.dumps(cache))
+        if images:
+            cache.update(namespace, search, images)
+        else:
+            cache.delete(namespace, search)
 
-            return url, title
-        return cache
+        return url, title
 
     @commands.command()
     async def google(self, ctx, *, search):
@@ -462,11 +475,10 @@ class useful(commands.Cog):
         """
         embed = discord.Embed(color=discord.Color.blurple())
 
-        cache_search = f"google-{search.lower()}"
-        cache = await self.cache_check(cache_search)
+        search = search.lower()
 
-        if isinstance(cache, tuple):
-            url, title = cache
+        if cached := self.cache_check("google", search):
+            url, title = cached
             embed.set_image(url=url)
             embed.title = title
 
@@ -475,13 +487,7 @@ class useful(commands.Cog):
 
         async with ctx.typing():
             url = f"https://www.google.co.nz/search?q={search}&source=lnms&tbm=isch&safe=active"
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.67 Safari/537.36"
-            }
-            async with aiohttp.ClientSession(headers=headers) as session, session.get(
-                url
-            ) as page:
-                soup = lxml.html.fromstring(await page.text())
+            soup = await self.get_page(url)
 
             images = {}
             for a in soup.xpath('.//img[@class="rg_i Q4LuWd"]'):
@@ -502,9 +508,8 @@ class useful(commands.Cog):
 
             message = await ctx.send(embed=embed)
 
-            cache[cache_search] = images
-            self.loop.call_later(300, DB.delete_cache, cache_search, cache)
-            DB.db.put(b"cache", orjson.dumps(cache))
+            if images:
+                cache.put("google", search, images, persist=True)
 
         await self.wait_for_deletion(message, ctx)
 
@@ -517,11 +522,8 @@ class useful(commands.Cog):
         """
         embed = discord.Embed(color=discord.Color.blurple())
 
-        cache_search = f"image-{search}"
-        cache = await self.cache_check(cache_search)
-
-        if isinstance(cache, tuple):
-            url, title = cache
+        if cached := self.cache_check("image", search):
+            url, title = cached
             embed.set_image(url=url)
             embed.title = title
 
@@ -530,13 +532,7 @@ class useful(commands.Cog):
 
         async with ctx.typing():
             url = f"https://www.bing.com/images/search?q={search}&first=1"
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.67 Safari/537.36"
-            }
-            async with aiohttp.ClientSession(headers=headers) as session, session.get(
-                url
-            ) as page:
-                soup = lxml.html.fromstring(await page.text())
+            soup = await self.get_page(url)
 
             images = {}
             for a in soup.xpath('.//a[@class="iusc"]'):
@@ -555,9 +551,8 @@ class useful(commands.Cog):
 
             message = await ctx.send(embed=embed)
 
-            cache[cache_search] = images
-            self.loop.call_later(300, DB.delete_cache, cache_search, cache)
-            DB.db.put(b"cache", orjson.dumps(cache))
+            if images:
+                cache.put("image", search, images, persist=True)
 
         await self.wait_for_deletion(message, ctx)
 
@@ -622,9 +617,9 @@ class useful(commands.Cog):
         escape = str.maketrans({"`": "\\`"})
         ansi = re.compile(r"\x1b\[.*?m")
 
-        async with ctx.typing(), aiohttp.ClientSession(
-            headers=headers
-        ) as session, session.get(url) as page:
+        async with ctx.typing(), self.bot.client_session.get(
+            url, headers=headers
+        ) as page:
             result = ansi.sub("", await page.text()).translate(escape)
 
         embed = discord.Embed(
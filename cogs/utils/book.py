@@ -0,0 +1,109 @@
+import mmap
+import os
+import random
+import struct
+from collections import Counter
+from cogs.utils.sunfish import Position, initial, parse, position_key
+
+
+BOOK_PATH = "data/book.bin"
+OPENINGS_PATH = "data/openings.txt"
+
+# Each record is a position key, the from and to squares of a move played
+# from it and how many openings play that move. Records are sorted by key so
+# a position is found with a binary search straight from the mapped file.
+RECORD = struct.Struct(">QBBH")
+
+_book = None
+
+
+def build(source=OPENINGS_PATH, path=BOOK_PATH):
+    """Builds the opening book from a file of opening lines.
+
+    The bot always plays black so only blacks moves are stored.
+
+    source: str
+        A file with an opening per line in coordinate notation.
+    path: str
+    """
+    moves = Counter()
+
+    with open(source, encoding="utf-8") as file:
+        for line in file:
+            line = line.split("#", 1)[0].split()
+            pos = Position(initial, 0, (True, True), (True, True), 0, 0)
+
+            for ply, coords in enumerate(line):
+                move = parse(coords[:2]), parse(coords[2:])
+
+                # Positions are always from the side to moves view
+                if ply % 2:
+                    move = 119 - move[0], 119 - move[1]
+
+                if move not in pos.gen_moves():
+                    raise ValueError(f"Illegal move {coords} in {' '.join(line)}")
+
+                if ply % 2:
+                    moves[(position_key(pos),) + move] += 1
+
+                pos = pos.move(move)
+
+    # Written to a temporary file first so a mapped book is never changed
+    with open(f"{path}.tmp", "wb") as file:
+        for (key, i, j), count in sorted(moves.items()):
+            file.write(RECORD.pack(key, i, j, min(count, 0xFFFF)))
+
+    os.replace(f"{path}.tmp", path)
+
+
+def load(path=BOOK_PATH, source=OPENINGS_PATH):
+    """Memory maps the opening book rebuilding it if the openings changed.
+
+    path: str
+    source: str
+    """
+    global _book
+
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(source):
+        build(source, path)
+
+    with open(path, "rb") as file:
+        _book = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def probe(pos):
+    """Returns a book move for a position or None if it isn't in the book.
+
+    Moves are picked at random weighted by how many openings play them.
+
+    pos: Position
+    """
+    if not _book:
+        return None
+
+    key = position_key(pos)
+    low, high = 0, len(_book) // RECORD.size
+
+    while low < high:
+        middle = (low + high) // 2
+
+        if RECORD.unpack_from(_book, middle * RECORD.size)[0] < key:
+            low = middle + 1
+        else:
+            high = middle
+
+    moves = []
+    weights = []
+
+    for offset in range(low * RECORD.size, len(_book), RECORD.size):
+        record_key, i, j, count = RECORD.unpack_from(_book, offset)
+
+        if record_key != key:
+            break
+
+        moves.append((i, j))
+        weights.append(count)
+
+    if moves:
+        return random.choices(moves, weights)[0]
+    return None
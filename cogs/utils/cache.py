@@ -0,0 +1,175 @@
+import time
+from collections import OrderedDict, defaultdict
+import orjson
+import cogs.utils.database as DB
+
+
+DEFAULT_TTL = 300
+MAX_SIZE = 32 * 1024 * 1024
+SWEEP_INTERVAL = 60
+
+# Entries keyed by (namespace, key) in least recently used order. Each entry
+# is [expires, size, value, persist] where size is the length of the value
+# as json which is used to keep the cache under MAX_SIZE.
+_entries = OrderedDict()
+_size = 0
+_last_sweep = 0
+
+stats = defaultdict(lambda: {"hits": 0, "misses": 0, "evictions": 0, "expired": 0})
+
+
+def _db_key(namespace, key):
+    return f"{namespace}-{key}"
+
+
+def _remove(entry_key, reason=None):
+    """Removes an entry.
+
+    entry_key: tuple
+    reason: str
+        The stat to count the removal under.
+    """
+    global _size
+
+    _, size, _, persist = _entries.pop(entry_key)
+    _size -= size
+
+    if persist:
+        DB.delete_cache(_db_key(*entry_key))
+    if reason:
+        stats[entry_key[0]][reason] += 1
+
+
+def _sweep():
+    """Removes every expired entry."""
+    global _last_sweep
+
+    _last_sweep = now = time.time()
+
+    for entry_key in [key for key, entry in _entries.items() if entry[0] <= now]:
+        _remove(entry_key, "expired")
+
+
+def _add(entry_key, expires, data, value, persist):
+    """Adds an entry evicting the least recently used entries if needed.
+
+    entry_key: tuple
+    expires: float
+    data: bytes
+        The value encoded as json.
+    value
+    persist: bool
+    """
+    global _size
+
+    if entry_key in _entries:
+        _remove(entry_key)
+
+    _entries[entry_key] = [expires, len(data), value, persist]
+    _size += len(data)
+
+    if time.time() - _last_sweep > SWEEP_INTERVAL:
+        _sweep()
+
+    while _size > MAX_SIZE and len(_entries) > 1:
+        _remove(next(iter(_entries)), "evictions")
+
+
+def get(namespace, key, default=None):
+    """Gets an unexpired value from the cache.
+
+    namespace: str
+    key: str
+    default
+        Returned if the key isn't cached.
+    """
+    entry_key = (namespace, key)
+    entry = _entries.get(entry_key)
+
+    if entry and entry[0] <= time.time():
+        _remove(entry_key, "expired")
+        entry = None
+
+    if not entry:
+        stats[namespace]["misses"] += 1
+        return default
+
+    stats[namespace]["hits"] += 1
+    _entries.move_to_end(entry_key)
+    return entry[2]
+
+
+def put(namespace, key, value, ttl=DEFAULT_TTL, persist=False):
+    """Caches a value.
+
+    namespace: str
+    key: str
+    value
+        Any json serializable value.
+    ttl: float
+        How many seconds until the value expires.
+    persist: bool
+        Whether to store the value in the db so it survives restarts.
+    """
+    data = orjson.dumps(value)
+    expires = time.time() + ttl
+
+    _add((namespace, key), expires, data, value, persist)
+
+    if persist:
+        DB.put_cache(_db_key(namespace, key), expires, data)
+
+
+def update(namespace, key, value):
+    """Replaces a cached value keeping its expiry.
+
+    namespace: str
+    key: str
+    value
+    """
+    if entry := _entries.get((namespace, key)):
+        put(namespace, key, value, entry[0] - time.time(), entry[3])
+
+
+def delete(namespace, key):
+    """Removes a value from the cache.
+
+    namespace: str
+    key: str
+    """
+    if (namespace, key) in _entries:
+        _remove((namespace, key))
+
+
+def wipe():
+    """Removes every value from the cache."""
+    for entry_key in list(_entries):
+        _remove(entry_key)
+
+
+def entries():
+    """Returns (namespace, key, seconds until expiry, size) of every entry."""
+    _sweep()
+    now = time.time()
+
+    return [
+        (namespace, key, expires - now, size)
+        for (namespace, key), (expires, size, _, _) in _entries.items()
+    ]
+
+
+def size():
+    """Returns the size of the cache in bytes."""
+    return _size
+
+
+async def load():
+    """Loads the persisted entries from the db.
+
+    Entries cached before the load finished are newer so they are kept.
+    """
+    for db_key, expires, data in await DB.get_caches():
+        namespace, key = db_key.split("-", 1)
+
+        if (namespace, key) not in _entries:
+            _add((namespace, key), expires, data, orjson.loads(data), True)
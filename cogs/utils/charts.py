@@ -0,0 +1,165 @@
+import asyncio
+import time
+from collections import OrderedDict
+from io import BytesIO
+from PIL import Image, ImageDraw, ImageFont
+import cogs.utils.database as DB
+
+
+WIDTH = 800
+HEIGHT = 300
+MARGIN = 40
+CANDLES = 48
+CACHE_SIZE = 128
+BACKGROUND = (47, 49, 54)
+GRID = (79, 84, 92)
+TEXT = (220, 221, 222)
+GREEN = (67, 181, 129)
+RED = (240, 71, 71)
+
+# Rendered charts keyed by kind, symbol, window, style and the time of the
+# symbols last tick, which is kept in memory so a cached chart is returned
+# without reading the history and is only drawn once per price update
+_cache = OrderedDict()
+
+
+def _scale(values, low, high, size):
+    """Scales values to pixel positions with the highest value at the top.
+
+    values: Iterable[float]
+    low: float
+    high: float
+    size: int
+        The height of the chart area.
+    """
+    spread = (high - low) or 1
+    return [MARGIN + size - (value - low) / spread * size for value in values]
+
+
+def _draw_axes(draw, low, high, start, end):
+    """Draws the grid and the price and time labels.
+
+    draw: PIL.ImageDraw.ImageDraw
+    low: float
+    high: float
+    start: float
+    end: float
+    """
+    font = ImageFont.load_default()
+
+    for y, price in ((MARGIN, high), (HEIGHT - MARGIN, low)):
+        draw.line(((MARGIN, y), (WIDTH - MARGIN, y)), fill=GRID)
+        draw.text((4, y - 12), f"${price:,.2f}", fill=TEXT, font=font)
+
+    for x, timestamp in ((MARGIN, start), (WIDTH - MARGIN * 3, end)):
+        label = time.strftime("%d %b %H:%M", time.gmtime(timestamp))
+        draw.text((x, HEIGHT - MARGIN + 8), label, fill=TEXT, font=font)
+
+
+def render_line(timestamps, prices):
+    """Renders a line chart as a PNG.
+
+    timestamps: array
+    prices: array
+    """
+    img = Image.new("RGB", (WIDTH, HEIGHT), BACKGROUND)
+    draw = ImageDraw.Draw(img)
+    low, high = min(prices), max(prices)
+    start, end = timestamps[0], timestamps[-1]
+    width = WIDTH - MARGIN * 2
+    height = HEIGHT - MARGIN * 2
+
+    _draw_axes(draw, low, high, start, end)
+
+    xs = [MARGIN + (t - start) / ((end - start) or 1) * width for t in timestamps]
+    ys = _scale(prices, low, high, height)
+    color = GREEN if prices[-1] >= prices[0] else RED
+    draw.line(list(zip(xs, ys)), fill=color, width=2)
+
+    with BytesIO() as image_binary:
+        img.save(image_binary, "PNG")
+        return image_binary.getvalue()
+
+
+def render_candlestick(timestamps, prices):
+    """Renders a candlestick chart as a PNG.
+
+    timestamps: array
+    prices: array
+    """
+    img = Image.new("RGB", (WIDTH, HEIGHT), BACKGROUND)
+    draw = ImageDraw.Draw(img)
+    low, high = min(prices), max(prices)
+    start, end = timestamps[0], timestamps[-1]
+    height = HEIGHT - MARGIN * 2
+    candle_width = (WIDTH - MARGIN * 2) / CANDLES
+    interval = ((end - start) or 1) / CANDLES
+
+    _draw_axes(draw, low, high, start, end)
+
+    candles = {}
+    for timestamp, price in zip(timestamps, prices):
+        index = min(int((timestamp - start) / interval), CANDLES - 1)
+
+        if index not in candles:
+            candles[index] = [price, price, price, price]
+        else:
+            candle = candles[index]
+            candle[1] = max(candle[1], price)
+            candle[2] = min(candle[2], price)
+            candle[3] = price
+
+    for index, candle in candles.items():
+        open_y, high_y, low_y, close_y = _scale(candle, low, high, height)
+        color = GREEN if candle[3] >= candle[0] else RED
+        left = MARGIN + index * candle_width
+        middle = left + candle_width / 2
+
+        draw.line(((middle, high_y), (middle, low_y)), fill=color)
+        draw.rectangle(
+            (
+                (left + 1, min(open_y, close_y)),
+                (left + candle_width - 1, max(open_y, close_y)),
+            ),
+            fill=color,
+        )
+
+    with BytesIO() as image_binary:
+        img.save(image_binary, "PNG")
+        return image_binary.getvalue()
+
+
+async def get_chart(kind, symbol, window=86400, style="line"):
+    """Returns a PNG chart of a symbols price history.
+
+    Returns None if there isn't enough history to draw a chart.
+
+    kind: str
+        Either stocks or crypto.
+    symbol: str
+    window: float
+        How many seconds of history to show.
+    style: str
+        Either line or candle.
+    """
+    key = (kind, symbol, window, style, DB.get_last_tick(kind, symbol))
+
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+
+    timestamps, prices = await DB.get_history(kind, symbol, time.time() - window)
+
+    if len(prices) < 2:
+        return None
+
+    render = render_candlestick if style == "candle" else render_line
+    chart = await asyncio.get_running_loop().run_in_executor(
+        None, render, timestamps, prices
+    )
+
+    _cache[key] = chart
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+
+    return chart
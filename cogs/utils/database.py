@@ -1,4 +1,12 @@
+import asyncio
+import atexit
+import itertools
 import pathlib
+import struct
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 import plyvel
 import orjson
 
@@ -18,22 +26,539 @@ cryptobal = db.prefixed_db(b"cryptobal-")
 crypto = db.prefixed_db(b"crypto-")
 stocks = db.prefixed_db(b"stocks-")
 stockbal = db.prefixed_db(b"stockbal-")
+stockpos = db.prefixed_db(b"stockpos-")
+stocktrades = db.prefixed_db(b"stocktrades-")
+cryptopos = db.prefixed_db(b"cryptopos-")
+cryptotrades = db.prefixed_db(b"cryptotrades-")
+stockhistory = db.prefixed_db(b"stockhistory-")
+cryptohistory = db.prefixed_db(b"cryptohistory-")
 bal = db.prefixed_db(b"bal-")
+baltop = db.prefixed_db(b"baltop-")
 wins = db.prefixed_db(b"wins-")
 message_count = db.prefixed_db(b"message_count-")
+cache = db.prefixed_db(b"cache-")
+chessmoves = db.prefixed_db(b"chessmoves-")
+timers = db.prefixed_db(b"timers-")
+timernames = db.prefixed_db(b"timernames-")
 
+# All of the async helpers below run on this single thread so a slow
+# LevelDB call never blocks the event loop. Writes are queued in _pending
+# and committed together in one write_batch the next time the thread is free.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="leveldb")
+_pending = {}
+_pending_lock = threading.Lock()
+_commit_scheduled = False
 
-@staticmethod
-def delete_cache(search, cache):
-    """Deletes a search from the cache.
 
-    search: str
-    """
-    try:
-        cache.pop(search)
-    except KeyError:
+def _commit():
+    """Commits all pending writes in a single write batch."""
+    global _commit_scheduled
+
+    with _pending_lock:
+        writes = _pending.copy()
+        _pending.clear()
+        _commit_scheduled = False
+
+    if not writes:
         return
-    db.put(b"cache", orjson.dumps(cache))
+
+    with db.write_batch() as wb:
+        for key, value in writes.items():
+            if value is None:
+                wb.delete(key)
+            else:
+                wb.put(key, value)
+
+
+def _get(prefixed, key):
+    """Gets a key taking into account writes that haven't been committed yet.
+
+    prefixed: plyvel.PrefixedDB
+    key: bytes
+    """
+    with _pending_lock:
+        if (full_key := prefixed.prefix + key) in _pending:
+            return _pending[full_key]
+
+    return prefixed.get(key)
+
+
+def _put(prefixed, key, value):
+    """Queues a write to be committed in the next write batch.
+
+    prefixed: plyvel.PrefixedDB
+    key: bytes
+    value: bytes
+        None deletes the key.
+    """
+    global _commit_scheduled
+
+    with _pending_lock:
+        _pending[prefixed.prefix + key] = value
+
+        if _commit_scheduled:
+            return
+        _commit_scheduled = True
+
+    _executor.submit(_commit)
+
+
+async def run(func, *args):
+    """Runs a function on the database thread.
+
+    func: Callable
+    """
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
+async def flush():
+    """Waits until every queued write has been committed."""
+    await run(_commit)
+
+
+# Ids are stored as big endian unsigned 8 byte keys so they sort numerically
+# and numbers as packed 8 byte integers or floats rather than decimal strings.
+_packed_id = struct.Struct(">Q")
+_packed_int = struct.Struct(">q")
+_packed_float = struct.Struct(">d")
+
+
+def pack_id(snowflake):
+    """Packs an id into an 8 byte key.
+
+    snowflake: Union[int, bytes]
+        Either an int or a decimal bytes string.
+    """
+    return _packed_id.pack(int(snowflake))
+
+
+def unpack_id(key):
+    """Unpacks an 8 byte key into an id.
+
+    key: bytes
+    """
+    return _packed_id.unpack(key)[0]
+
+
+def pack_int(number):
+    """Packs an int into 8 bytes.
+
+    number: int
+    """
+    return _packed_int.pack(number)
+
+
+def unpack_int(value):
+    """Unpacks 8 bytes into an int.
+
+    value: bytes
+    """
+    return _packed_int.unpack(value)[0]
+
+
+def pack_float(number):
+    """Packs a float into 8 bytes.
+
+    number: float
+    """
+    return _packed_float.pack(number)
+
+
+def unpack_float(value):
+    """Unpacks 8 bytes into a float.
+
+    value: bytes
+    """
+    return _packed_float.unpack(value)[0]
+
+
+def decode(key, value):
+    """Returns a key and value from the db as strings unpacking any numbers.
+
+    key: bytes
+    value: bytes
+    """
+    prefix, _, rest = key.partition(b"-")
+
+    if prefix == b"bal":
+        return f"bal-{unpack_id(rest)}", str(unpack_float(value))
+
+    if prefix == b"karma":
+        return f"karma-{unpack_id(rest)}", str(unpack_int(value))
+
+    if prefix == b"message_count":
+        guild, member = unpack_id(rest[:8]), unpack_id(rest[8:])
+        return f"message_count-{guild}-{member}", str(unpack_int(value))
+
+    if prefix in (b"stockpos", b"cryptopos"):
+        member, symbol = unpack_id(rest[:8]), rest[8:].decode()
+        return f"{prefix.decode()}-{member}-{symbol}", value.decode()
+
+    if prefix in (b"stocktrades", b"cryptotrades"):
+        member, seq = unpack_id(rest[:8]), unpack_id(rest[-8:])
+        symbol = rest[8:-9].decode()
+        key = f"{prefix.decode()}-{member}-{symbol}-{seq}"
+        return key, str(list(_packed_trade.unpack(value)))
+
+    if prefix == b"timers":
+        due_at, suffix = unpack_float(rest[:8]), unpack_id(rest[8:])
+        return f"timers-{due_at}-{suffix}", value.decode()
+
+    if prefix == b"timernames":
+        due_at, suffix = unpack_float(value[:8]), unpack_id(value[8:])
+        return key.decode(), f"{due_at}-{suffix}"
+
+    if (prefix == b"invites" and b"-" in rest) or key in (
+        b"backup_number",
+        b"codec_version",
+        b"stockshistory_compacted",
+        b"cryptohistory_compacted",
+    ):
+        return key.decode(), str(unpack_int(value))
+
+    return key.decode(), value.decode()
+
+
+def _migrate_numbers(wb):
+    """Converts the numbers stored as decimal strings to the packed format.
+
+    wb: plyvel.WriteBatch
+    """
+    for key, value in bal:
+        wb.delete(bal.prefix + key)
+        wb.put(bal.prefix + pack_id(key), pack_float(float(value)))
+
+    for key, value in karma:
+        wb.delete(karma.prefix + key)
+        wb.put(karma.prefix + pack_id(key), pack_int(int(value)))
+
+    for key, value in message_count:
+        guild, member = key.split(b"-")
+        wb.delete(message_count.prefix + key)
+        wb.put(
+            message_count.prefix + pack_id(guild) + pack_id(member),
+            pack_int(int(value)),
+        )
+
+    for key, value in invites:
+        if b"-" in key:
+            wb.put(invites.prefix + key, pack_int(int(value)))
+
+    # The index is rebuilt from the packed balances by _build_baltop
+    for key in baltop.iterator(include_value=False):
+        wb.delete(baltop.prefix + key)
+
+    if number := db.get(b"backup_number"):
+        wb.put(b"backup_number", pack_int(int(number)))
+
+
+def _migrate_ledgers(wb):
+    """Splits the stockbal and cryptobal documents into positions and trades.
+
+    wb: plyvel.WriteBatch
+    """
+    for kind, documents in (("stocks", stockbal), ("crypto", cryptobal)):
+        positions, trades = _ledgers[kind]
+
+        for member_id, data in documents:
+            wb.delete(documents.prefix + member_id)
+            member_id = pack_id(member_id)
+
+            for symbol, holding in orjson.loads(data).items():
+                for seq, (amount, cash) in enumerate(holding["history"]):
+                    wb.put(
+                        trades.prefix + _trade_key(member_id, symbol, seq),
+                        _packed_trade.pack(amount, cash),
+                    )
+
+                wb.put(
+                    positions.prefix + _position_key(member_id, symbol),
+                    orjson.dumps(
+                        {"total": holding["total"], "trades": len(holding["history"])}
+                    ),
+                )
+
+
+def _migrate_cost_basis(wb):
+    """Adds the cash spent and amount bought from the trade log to positions.
+
+    wb: plyvel.WriteBatch
+    """
+    for positions, trades in _ledgers.values():
+        for key, position in positions:
+            position = orjson.loads(position)
+            position["cash"] = position["units"] = total = 0
+
+            for trade in trades.iterator(prefix=key + b"\x00", include_key=False):
+                amount, cash = _packed_trade.unpack(trade)
+                total += amount
+
+                # Selling everything starts a new cost basis
+                if not total:
+                    position["cash"] = position["units"] = 0
+                elif amount > 0:
+                    position["cash"] += cash
+                    position["units"] += amount
+
+            wb.put(positions.prefix + key, orjson.dumps(position))
+
+
+def _migrate_cache(wb):
+    """Deletes the old json cache document.
+
+    wb: plyvel.WriteBatch
+    """
+    wb.delete(b"cache")
+
+
+def _migrate_playing_chess(wb):
+    """Deletes the old global chess logging key.
+
+    wb: plyvel.WriteBatch
+    """
+    wb.delete(b"playing_chess")
+
+
+def _migrate():
+    """Converts the db to the current format one version at a time."""
+    if version := db.get(b"codec_version"):
+        version = unpack_int(version)
+    else:
+        version = 0
+
+    migrations = (
+        _migrate_numbers,
+        _migrate_ledgers,
+        _migrate_cost_basis,
+        _migrate_cache,
+        _migrate_playing_chess,
+    )
+
+    for version, migration in enumerate(migrations[version:], start=version + 1):
+        with db.write_batch() as wb:
+            migration(wb)
+            wb.put(b"codec_version", pack_int(version))
+
+
+# Message counts are incremented for every message the bot sees so they are
+# kept in memory and added onto the stored counts in batches.
+MESSAGE_COUNT_BATCH_SIZE = 1000
+_message_counts = {}
+_message_count_increments = 0
+
+
+def _flush_message_counts():
+    """Adds the in memory message counts onto the stored counts."""
+    global _message_count_increments
+
+    with _pending_lock:
+        counts = _message_counts.copy()
+        _message_counts.clear()
+        _message_count_increments = 0
+
+    for key, count in counts.items():
+        if stored := _get(message_count, key):
+            count += unpack_int(stored)
+        _put(message_count, key, pack_int(count))
+
+
+def add_message_count(guild, member_id):
+    """Adds one to a members message count in a guild.
+
+    guild: int
+    member_id: int
+    """
+    global _message_count_increments
+    key = pack_id(guild) + pack_id(member_id)
+
+    with _pending_lock:
+        _message_counts[key] = _message_counts.get(key, 0) + 1
+        _message_count_increments += 1
+
+        if _message_count_increments != MESSAGE_COUNT_BATCH_SIZE:
+            return
+
+    _executor.submit(_flush_message_counts)
+
+
+def flush_message_counts():
+    """Queues the in memory message counts to be written."""
+    return _executor.submit(_flush_message_counts)
+
+
+async def get_message_counts(guild):
+    """Returns the message count of every member in a guild.
+
+    guild: int
+    """
+
+    def _get_message_counts():
+        _flush_message_counts()
+        _commit()
+        return [
+            (unpack_int(count), f"{guild}-{unpack_id(key[8:])}")
+            for key, count in message_count.iterator(prefix=pack_id(guild))
+        ]
+
+    return await run(_get_message_counts)
+
+
+@atexit.register
+def _shutdown():
+    """Writes everything still in memory before exiting."""
+    global _commit_scheduled
+    # The executor has already shut down so stop _put from submitting to it
+    _commit_scheduled = True
+    _flush_message_counts()
+    _commit()
+
+
+async def get_caches():
+    """Returns the unexpired persisted cache entries as (key, expires, value).
+
+    Expired entries are deleted.
+    """
+
+    def _get_caches():
+        entries = []
+        now = time.time()
+
+        for key, value in cache:
+            expires = unpack_float(value[:8])
+
+            if expires <= now:
+                _put(cache, key, None)
+            else:
+                entries.append((key.decode(), expires, value[8:]))
+
+        return entries
+
+    return await run(_get_caches)
+
+
+def put_cache(key, expires, value):
+    """Queues a cache entry to be persisted.
+
+    key: str
+    expires: float
+        The unix time the entry expires at.
+    value: bytes
+    """
+    _put(cache, key.encode(), pack_float(expires) + value)
+
+
+def delete_cache(key):
+    """Queues a persisted cache entry to be deleted.
+
+    key: str
+    """
+    _put(cache, key.encode(), None)
+
+
+# Searched chess positions keyed by their packed position key with the level
+# they were searched at, the best moves squares and its score
+_packed_chess_move = struct.Struct(">BBBi")
+
+
+async def get_chess_move(key):
+    """Returns the level, move and score of a searched position or None.
+
+    key: int
+        The positions key from sunfish.position_key.
+    """
+    if data := await run(_get, chessmoves, pack_id(key)):
+        level, i, j, score = _packed_chess_move.unpack(data)
+        return level, (i, j), score
+    return None
+
+
+def put_chess_move(key, level, move, score):
+    """Queues a searched positions best move to be stored.
+
+    key: int
+    level: int
+    move: tuple
+    score: int
+    """
+    _put(chessmoves, pack_id(key), _packed_chess_move.pack(level, *move, score))
+
+
+# Timers are keyed by their packed due time followed by a unique suffix.
+# Positive floats packed big endian sort numerically so iterating the prefix
+# yields the timers in the order they are due. Named timers also have their
+# key stored under their name so they can be cancelled or replaced.
+async def get_due_timers(now, limit, actions):
+    """Returns the due timers that have a handler and when the next is due.
+
+    Returns a list of (key, action, args, name) and the unix time of the next
+    timer or None if there are no more timers.
+
+    now: float
+    limit: int
+        The most timers to return.
+    actions: Container[str]
+        The actions with a handler, other timers are left until theirs is
+        registered.
+    """
+
+    def _get_due_timers():
+        due = []
+
+        for key, value in timers:
+            if (due_at := unpack_float(key[:8])) > now:
+                return due, due_at
+
+            action, args, name = orjson.loads(value)
+
+            if action not in actions:
+                continue
+
+            due.append((key, action, args, name))
+
+            if len(due) >= limit:
+                break
+
+        return due, None
+
+    return await run(_get_due_timers)
+
+
+def get_timer(name):
+    """Returns the key of a named timer or None if it isn't scheduled.
+
+    name: str
+    """
+    return _get(timernames, name.encode())
+
+
+def put_timer(due_at, value, name=None):
+    """Queues a timer to be stored and returns its key.
+
+    due_at: float
+        The unix time the timer is due.
+    value: bytes
+    name: str
+    """
+    key = pack_float(due_at) + pack_id(time.time_ns())
+    _put(timers, key, value)
+
+    if name:
+        _put(timernames, name.encode(), key)
+
+    return key
+
+
+def delete_timer(key, name=None):
+    """Queues a timer to be deleted.
+
+    key: bytes
+    name: str
+        The timers name which is only removed if it still refers to the timer.
+    """
+    _put(timers, key, None)
+
+    if name and get_timer(name) == key:
+        _put(timernames, name.encode(), None)
 
 
 async def add_karma(member_id, amount):
@@ -42,15 +567,40 @@ async def add_karma(member_id, amount):
     member_id: int
     amount: int
     """
-    member_id = str(member_id).encode()
-    member_karma = karma.get(member_id)
 
-    if not member_karma:
-        member_karma = amount
-    else:
-        member_karma = int(member_karma) + amount
+    def _add_karma(member_id):
+        member_karma = _get(karma, member_id)
+
+        if not member_karma:
+            member_karma = amount
+        else:
+            member_karma = unpack_int(member_karma) + amount
+
+        _put(karma, member_id, pack_int(member_karma))
+
+    await run(_add_karma, pack_id(member_id))
+
+
+async def get_karma(member_id):
+    """Gets a members karma.
+
+    member_id: int
+    """
+    karma_value = await run(_get, karma, pack_id(member_id))
+
+    if karma_value:
+        return unpack_int(karma_value)
+    return 0
+
 
-    karma.put(member_id, str(member_karma).encode())
+async def get_karmas():
+    """Returns every members karma from highest to lowest."""
+
+    def _get_karmas():
+        _commit()
+        return sorted([(unpack_int(k), unpack_id(m)) for m, k in karma], reverse=True)
+
+    return await run(_get_karmas)
 
 
 async def get_blacklist(member_id, guild=None):
@@ -58,32 +608,191 @@ async def get_blacklist(member_id, guild=None):
 
     member_id: int
     """
-    if state := blacklist.get(str(member_id).encode()):
-        return state
 
-    if guild and (state := blacklist.get(f"{guild}-{member_id}".encode())):
-        return state
+    def _get_blacklist():
+        if state := _get(blacklist, str(member_id).encode()):
+            return state
 
+        if guild and (state := _get(blacklist, f"{guild}-{member_id}".encode())):
+            return state
 
-async def get_bal(member_id):
-    """Gets the balance of an member.
+    return await run(_get_blacklist)
 
-    member_id: bytes
-    """
-    balance = bal.get(member_id)
+
+def _get_bal(member_id):
+    balance = _get(bal, pack_id(member_id))
 
     if balance:
-        return float(balance)
+        return unpack_float(balance)
 
     return 1000.0
 
 
+def _baltop_key(member_id, amount):
+    """Returns a baltop key which sorts from the highest balance to the lowest.
+
+    member_id: bytes
+        A packed member id.
+    amount: float
+    """
+    number = unpack_id(pack_float(amount))
+
+    # Negative floats already sort in descending order as unsigned integers
+    # so only positive floats need their bits flipped
+    if not number >> 63:
+        number ^= 0x7FFFFFFFFFFFFFFF
+
+    return _packed_id.pack(number) + member_id
+
+
+def _parse_baltop_key(key):
+    """Returns the balance and member id stored in a baltop key.
+
+    key: bytes
+    """
+    number = unpack_id(key[:8])
+
+    if not number >> 63:
+        number ^= 0x7FFFFFFFFFFFFFFF
+
+    return unpack_float(_packed_id.pack(number)), unpack_id(key[8:])
+
+
+# Ranks are counted with a fenwick tree over buckets of the baltop keys so a
+# rank only has to scan the keys in the members own bucket. The buckets are
+# the top RANK_BITS bits of the keys which splits balances within about 0.4%
+# of each other.
+RANK_BITS = 20
+_rank_tree = array("q", [0]) * ((1 << RANK_BITS) + 1)
+
+
+def _rank_bucket(key):
+    """Returns the bucket of a baltop key.
+
+    key: bytes
+    """
+    return unpack_id(key[:8]) >> (64 - RANK_BITS)
+
+
+def _count_rank(key, change):
+    """Adds to the count of a baltop keys bucket.
+
+    key: bytes
+    change: int
+    """
+    i = _rank_bucket(key) + 1
+
+    while i < len(_rank_tree):
+        _rank_tree[i] += change
+        i += i & -i
+
+
+def _count_before(bucket):
+    """Returns how many baltop keys are in the buckets before a bucket.
+
+    bucket: int
+    """
+    total = 0
+
+    while bucket:
+        total += _rank_tree[bucket]
+        bucket -= bucket & -bucket
+
+    return total
+
+
+def _build_baltop():
+    """Builds the baltop index from the stored balances if it is empty.
+
+    The rank counts are always rebuilt from the index.
+    """
+    if next(baltop.iterator(include_value=False), None) is None:
+        with db.write_batch() as wb:
+            for member_id, balance in bal:
+                key = _baltop_key(member_id, unpack_float(balance))
+                wb.put(baltop.prefix + key, b"")
+
+    for key in baltop.iterator(include_value=False):
+        _count_rank(key, 1)
+
+
+def _put_bal(member_id, amount):
+    key = pack_id(member_id)
+
+    if old := _get(bal, key):
+        old_key = _baltop_key(key, unpack_float(old))
+        _put(baltop, old_key, None)
+        _count_rank(old_key, -1)
+
+    new_key = _baltop_key(key, amount)
+    _put(baltop, new_key, b"")
+    _count_rank(new_key, 1)
+    _put(bal, key, pack_float(amount))
+    _update_balance(key, amount)
+    return amount
+
+
+def _add_bal(member_id, amount):
+    if amount < 0:
+        raise ValueError("You can't pay a negative amount")
+    return _put_bal(member_id, _get_bal(member_id) + amount)
+
+
+def _withdraw_bal(member_id, amount):
+    if amount < 0:
+        raise ValueError("You can't pay a negative amount")
+    return _put_bal(member_id, _get_bal(member_id) - amount)
+
+
+async def get_bal(member_id):
+    """Gets the balance of an member.
+
+    member_id: bytes
+    """
+    return await run(_get_bal, member_id)
+
+
 async def get_baltop(amount: int):
     """Gets the top [amount] balances.
 
     amount: int
     """
-    return sorted([(float(b), int(m)) for m, b in bal], reverse=True)[:amount]
+
+    def _get_baltop():
+        _commit()
+        return [
+            _parse_baltop_key(key)
+            for key in itertools.islice(
+                baltop.iterator(include_value=False), max(amount, 0)
+            )
+        ]
+
+    return await run(_get_baltop)
+
+
+async def get_rank(member_id):
+    """Gets a members position in baltop starting from 1.
+
+    Members with the same balance share a rank.
+
+    member_id: bytes
+    """
+
+    def _get_rank():
+        _commit()
+
+        if not (balance := bal.get(pack_id(member_id))):
+            return None
+
+        # Only the keys with a higher balance in the members bucket are read
+        stop = _baltop_key(b"", unpack_float(balance))
+        bucket = _rank_bucket(stop)
+        start = _packed_id.pack(bucket << (64 - RANK_BITS))
+        higher = baltop.iterator(start=start, stop=stop, include_value=False)
+
+        return _count_before(bucket) + sum(1 for _ in higher) + 1
+
+    return await run(_get_rank)
 
 
 async def put_bal(member_id, amount: float):
@@ -92,8 +801,7 @@ async def put_bal(member_id, amount: float):
     member_id: bytes
     amount: int
     """
-    bal.put(member_id, str(amount).encode())
-    return amount
+    return await run(_put_bal, member_id, amount)
 
 
 async def add_bal(member_id, amount: float):
@@ -102,9 +810,7 @@ async def add_bal(member_id, amount: float):
     member_id: bytes
     amount: int
     """
-    if amount < 0:
-        raise ValueError("You can't pay a negative amount")
-    return await put_bal(member_id, await get_bal(member_id) + amount)
+    return await run(_add_bal, member_id, amount)
 
 
 async def withdraw_bal(member_id, amount: float):
@@ -113,9 +819,7 @@ async def withdraw_bal(member_id, amount: float):
     member_id: bytes
     amount: int
     """
-    if amount < 0:
-        raise ValueError("You can't pay a negative amount")
-    return await put_bal(member_id, await get_bal(member_id) - amount)
+    return await run(_withdraw_bal, member_id, amount)
 
 
 async def transfer(_from, to, amount: float):
@@ -125,11 +829,21 @@ async def transfer(_from, to, amount: float):
     to: bytes
     amount: int
     """
-    from_bal = await get_bal(_from)
 
-    if from_bal > amount:
-        await add_bal(to, amount)
-        return await withdraw_bal(_from, amount)
+    def _transfer():
+        if _get_bal(_from) > amount:
+            _add_bal(to, amount)
+            return _withdraw_bal(_from, amount)
+
+    return await run(_transfer)
+
+
+def _get_json(prefixed, key, default=None):
+    data = _get(prefixed, key)
+
+    if data:
+        return orjson.loads(data)
+    return default
 
 
 async def get_stock(symbol):
@@ -137,11 +851,7 @@ async def get_stock(symbol):
 
     symbol: bytes
     """
-    stock = stocks.get(symbol.encode())
-
-    if stock:
-        return orjson.loads(stock)
-    return None
+    return await run(_get_json, stocks, symbol.encode())
 
 
 async def put_stock(symbol, data):
@@ -150,68 +860,579 @@ async def put_stock(symbol, data):
     symbol: bytes
     data: dict
     """
-    stocks.put(symbol.encode(), orjson.dumps(data))
+    _put(stocks, symbol.encode(), orjson.dumps(data))
+
+
+async def get_crypto(symbol):
+    """Returns the data of a crypto.
+
+    symbol: bytes
+    """
+    return await run(_get_json, crypto, symbol.encode())
+
+
+async def put_crypto(symbol, data):
+    """Sets the data of a crypto.
+
+    symbol: bytes
+    data: dict
+    """
+    _put(crypto, symbol.encode(), orjson.dumps(data))
 
 
-async def get_stockbal(member_id):
-    """Returns a members stockbal.
+# Holdings are stored as a position per member and symbol with each trade
+# appended to a log keyed by member, symbol and sequence number, so a trade
+# only writes the records it changes instead of the members whole history.
+_ledgers = {"stocks": (stockpos, stocktrades), "crypto": (cryptopos, cryptotrades)}
+_packed_trade = struct.Struct(">dd")
+
+
+def _position_key(member_id, symbol):
+    """Returns the key of a members position in a symbol.
 
     member_id: bytes
+        A packed member id.
+    symbol: str
     """
-    data = stockbal.get(member_id)
+    return member_id + symbol.encode()
 
-    if data:
-        return orjson.loads(data)
-    return {}
 
+def _trade_key(member_id, symbol, seq):
+    """Returns the key of a members trade in a symbol.
+
+    member_id: bytes
+        A packed member id.
+    symbol: str
+    seq: int
+    """
+    return _position_key(member_id, symbol) + b"\x00" + pack_id(seq)
 
-async def put_stockbal(member_id, data):
-    """Sets a members stockbal.
 
+def _get_positions(kind, member_id):
+    """Returns all of a members positions including ones they have sold.
+
+    kind: str
     member_id: bytes
-    data: dict
+        A packed member id.
     """
-    stockbal.put(member_id, orjson.dumps(data))
+    _commit()
+    return {
+        key[8:].decode(): orjson.loads(position)
+        for key, position in _ledgers[kind][0].iterator(prefix=member_id)
+    }
 
 
-async def get_crypto(symbol):
-    """Returns the data of a crypto.
+async def get_holdings(kind, member_id):
+    """Returns the positions a member currently holds.
 
-    symbol: bytes
+    kind: str
+        Either stocks or crypto.
+    member_id: bytes
     """
-    data = crypto.get(symbol.encode())
 
-    if data:
-        return orjson.loads(data)
+    def _get_holdings():
+        return {
+            symbol: position
+            for symbol, position in _get_positions(kind, pack_id(member_id)).items()
+            if position["total"]
+        }
+
+    return await run(_get_holdings)
+
+
+async def get_position(kind, member_id, symbol):
+    """Returns a members position in a symbol if they hold any.
+
+    The position has the total they hold, how many trades they have made
+    and the cash spent and amount bought which give their average price.
+
+    kind: str
+        Either stocks or crypto.
+    member_id: bytes
+    symbol: str
+    """
+    key = _position_key(pack_id(member_id), symbol)
+    position = await run(_get_json, _ledgers[kind][0], key)
+
+    if position and position["total"]:
+        return position
     return None
 
 
-async def put_crypto(symbol, data):
-    """Sets the data of a crypto.
+async def get_trades(kind, member_id, symbol, amount=None):
+    """Returns a members most recent trades in a symbol from oldest to newest.
 
-    symbol: bytes
-    data: dict
+    kind: str
+        Either stocks or crypto.
+    member_id: bytes
+    symbol: str
+    amount: int
+        How many trades to get defaulting to all of them.
     """
-    data = orjson.dumps(data)
-    crypto.put(symbol.encode(), data)
 
+    def _get_trades():
+        _commit()
+        trades = _ledgers[kind][1].iterator(
+            prefix=_position_key(pack_id(member_id), symbol) + b"\x00",
+            reverse=True,
+            include_key=False,
+        )
+        trades = itertools.islice(trades, amount)
+        return [_packed_trade.unpack(trade) for trade in trades][::-1]
+
+    return await run(_get_trades)
 
-async def get_cryptobal(member_id):
-    """Returns a members cryptobal.
 
+async def trade(kind, member_id, symbol, amount, cash):
+    """Buys or sells a stock or crypto and returns the members new balance.
+
+    kind: str
+        Either stocks or crypto.
     member_id: bytes
+    symbol: str
+    amount: float
+        The amount bought which is negative when selling.
+    cash: float
+        The cash paid or received.
     """
-    data = cryptobal.get(member_id)
 
-    if data:
-        return orjson.loads(data)
-    return {}
+    def _trade():
+        key = pack_id(member_id)
+        positions, trades = _ledgers[kind]
+        position_key = _position_key(key, symbol)
+        position = _get_json(
+            positions,
+            position_key,
+            {"total": 0, "trades": 0, "cash": 0, "units": 0},
+        )
+
+        position["total"] += amount
+
+        if position["total"]:
+            _put(
+                trades,
+                _trade_key(key, symbol, position["trades"]),
+                _packed_trade.pack(amount, cash),
+            )
+            position["trades"] += 1
 
+            if amount > 0:
+                position["cash"] += cash
+                position["units"] += amount
+        else:
+            # Selling everything closes the position and clears its history
+            # so buying again starts a new cost basis and trade log
+            _commit()
+            for trade_key in trades.iterator(
+                prefix=position_key + b"\x00", include_value=False
+            ):
+                _put(trades, trade_key, None)
 
-async def put_cryptobal(member_id, data):
-    """Sets a members cryptobal.
+            position.update(trades=0, cash=0, units=0)
+
+        _put(positions, position_key, orjson.dumps(position))
+        _update_holding(key, kind, symbol, position["total"])
+
+        balance = _get_bal(member_id)
+        return _put_bal(member_id, balance + cash if amount < 0 else balance - cash)
+
+    return await run(_trade)
+
+
+# Once nettop has been used every members balance and holdings are kept in
+# memory and their net worth is updated whenever their balance, holdings or
+# the prices change, so nettop doesn't have to decode every position and
+# price on each call. Only ever accessed from the database thread.
+_holdings = {}
+_prices = {"stocks": {}, "crypto": {}}
+_net_worths = {}
+_nettop = None
+_net_worths_loaded = False
+
+
+def _price(price):
+    try:
+        return float(price)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _value_member(member_id):
+    """Recalculates a members net worth from their cached holdings.
 
     member_id: bytes
-    data: dict
     """
-    cryptobal.put(member_id, orjson.dumps(data))
+    global _nettop
+    holdings = _holdings[member_id]
+
+    _net_worths[member_id] = holdings["bal"] + sum(
+        total * _prices[kind].get(symbol, 0.0)
+        for kind in ("stocks", "crypto")
+        for symbol, total in holdings[kind].items()
+    )
+    _nettop = None
+
+
+def _load_holdings(member_id):
+    """Returns the totals of a members stocks and crypto.
+
+    member_id: bytes
+        A packed member id.
+    """
+    return {
+        kind: {
+            symbol: position["total"]
+            for symbol, position in _get_positions(kind, member_id).items()
+            if position["total"]
+        }
+        for kind in ("stocks", "crypto")
+    }
+
+
+def _load_net_worths():
+    """Loads every members holdings and the current prices."""
+    global _net_worths_loaded
+    _commit()
+
+    for kind, prefixed in (("stocks", stocks), ("crypto", crypto)):
+        _prices[kind] = {
+            symbol.decode(): _price(orjson.loads(data)["price"])
+            for symbol, data in prefixed
+        }
+
+    for member_id, balance in bal:
+        _holdings[member_id] = {"bal": unpack_float(balance)}
+        _holdings[member_id].update(_load_holdings(member_id))
+        _value_member(member_id)
+
+    _net_worths_loaded = True
+
+
+def _update_balance(member_id, balance):
+    """Updates a members cached balance.
+
+    member_id: bytes
+        A packed member id.
+    balance: float
+    """
+    if not _net_worths_loaded:
+        return
+
+    if member_id not in _holdings:
+        _holdings[member_id] = _load_holdings(member_id)
+
+    _holdings[member_id]["bal"] = balance
+    _value_member(member_id)
+
+
+def _update_holding(member_id, kind, symbol, total):
+    """Updates a members cached total of a stock or crypto.
+
+    member_id: bytes
+        A packed member id.
+    kind: str
+    symbol: str
+    total: float
+    """
+    # Only members with a balance are ranked
+    if not _net_worths_loaded or member_id not in _holdings:
+        return
+
+    if total:
+        _holdings[member_id][kind][symbol] = total
+    else:
+        _holdings[member_id][kind].pop(symbol, None)
+
+    _value_member(member_id)
+
+
+async def update_prices(kind, prices):
+    """Revalues every net worth with new prices.
+
+    kind: str
+        Either stocks or crypto.
+    prices: dict
+        The price of each symbol.
+    """
+
+    def _update_prices():
+        _prices[kind] = {symbol: _price(price) for symbol, price in prices.items()}
+
+        if _net_worths_loaded:
+            for member_id in _holdings:
+                _value_member(member_id)
+
+    await run(_update_prices)
+
+
+async def get_nettop():
+    """Returns every members net worth from highest to lowest."""
+
+    def _get_nettop():
+        global _nettop
+
+        if not _net_worths_loaded:
+            _load_net_worths()
+
+        if _nettop is None:
+            _nettop = sorted(
+                [(value, unpack_id(member)) for member, value in _net_worths.items()],
+                reverse=True,
+            )
+
+        return _nettop
+
+    return await run(_get_nettop)
+
+
+# Every price tick is stored under symbol, day and timestamp as a packed
+# pair of doubles. Once a day is over its ticks are compacted into a single
+# chunk under symbol and day holding all of the pairs, so a window of history
+# is one range read. Chunks older than HISTORY_FULL_DAYS are downsampled to
+# one price per HISTORY_DOWNSAMPLE seconds and deleted after
+# HISTORY_RETENTION_DAYS.
+HISTORY_FULL_DAYS = 30
+HISTORY_RETENTION_DAYS = 365
+HISTORY_DOWNSAMPLE = 3600
+HISTORY_BATCH_SIZE = 1000
+_histories = {"stocks": stockhistory, "crypto": cryptohistory}
+# When each symbol was last ticked since the bot started so caches of its
+# history can tell if it has changed without reading it
+_last_ticks = {"stocks": {}, "crypto": {}}
+
+
+def _history_key(symbol, day):
+    """Returns the key of a symbols history chunk for a day.
+
+    symbol: str
+    day: int
+        Days since the epoch.
+    """
+    return symbol.encode() + b"\x00" + pack_id(day)
+
+
+async def add_ticks(kind, ticks, timestamp=None):
+    """Adds a price tick to the history of each symbol.
+
+    kind: str
+        Either stocks or crypto.
+    ticks: List[Tuple[str, Union[str, float]]]
+        The symbol and price of each tick.
+    timestamp: float
+        Defaults to the current time.
+    """
+    timestamp = timestamp or time.time()
+    day = int(timestamp // 86400)
+    suffix = pack_id(int(timestamp))
+    last_ticks = _last_ticks[kind]
+
+    for symbol, _ in ticks:
+        last_ticks[symbol] = timestamp
+
+    def _add_ticks():
+        with _histories[kind].write_batch() as wb:
+            for symbol, price in ticks:
+                wb.put(
+                    _history_key(symbol, day) + suffix,
+                    array("d", (timestamp, _price(price))).tobytes(),
+                )
+
+    await run(_add_ticks)
+
+
+def get_last_tick(kind, symbol):
+    """Returns when a symbol was last ticked since the bot started or None.
+
+    kind: str
+        Either stocks or crypto.
+    symbol: str
+    """
+    return _last_ticks[kind].get(symbol)
+
+
+async def get_history(kind, symbol, start, end=None):
+    """Returns the timestamps and prices of a symbol in a window.
+
+    The arrays are of doubles so they can be wrapped without copying, e.g.
+    by numpy.frombuffer.
+
+    kind: str
+        Either stocks or crypto.
+    symbol: str
+    start: float
+        The timestamp the window starts at.
+    end: float
+        The timestamp the window ends at defaulting to the current time.
+    """
+    end = end or time.time()
+
+    def _get_history():
+        data = array("d")
+
+        for value in _histories[kind].iterator(
+            start=_history_key(symbol, int(start // 86400)),
+            stop=_history_key(symbol, int(end // 86400) + 1),
+            include_key=False,
+        ):
+            data.frombytes(value)
+
+        timestamps, prices = array("d"), array("d")
+
+        for timestamp, price in zip(data[::2], data[1::2]):
+            if start <= timestamp <= end:
+                timestamps.append(timestamp)
+                prices.append(price)
+
+        return timestamps, prices
+
+    return await run(_get_history)
+
+
+def _downsample(data, interval):
+    """Keeps the last price in each interval.
+
+    data: array
+        Pairs of timestamps and prices.
+    interval: int
+        The length of each interval in seconds.
+    """
+    buckets = {}
+
+    for timestamp, price in zip(data[::2], data[1::2]):
+        buckets[int(timestamp // interval)] = (timestamp, price)
+
+    return array("d", itertools.chain.from_iterable(buckets.values()))
+
+
+def _compact_chunks(wb, items, today):
+    """Compacts, downsamples or deletes the chunks of a symbols history.
+
+    Returns how many chunks were rewritten.
+
+    wb: plyvel.WriteBatch
+    items: Iterable[Tuple[bytes, bytes]]
+        The keys and values of the history in key order.
+    today: int
+    """
+    written = 0
+
+    def get_chunk_key(item):
+        """Returns the key of the chunk for the day of a tick."""
+        return item[0][: item[0].index(b"\x00") + 9]
+
+    for chunk_key, group in itertools.groupby(items, key=get_chunk_key):
+        age = today - unpack_id(chunk_key[-8:])
+
+        if not age:
+            continue
+
+        keys, data = [], array("d")
+
+        for key, value in group:
+            keys.append(key)
+            data.frombytes(value)
+
+        if age > HISTORY_RETENTION_DAYS:
+            chunk = None
+        elif age > HISTORY_FULL_DAYS:
+            chunk = _downsample(data, HISTORY_DOWNSAMPLE)
+        else:
+            chunk = data
+
+        # Skip chunks which have already been compacted and downsampled
+        if keys == [chunk_key] and chunk is not None and len(chunk) == len(data):
+            continue
+
+        for key in keys:
+            wb.delete(key)
+
+        if chunk is not None:
+            wb.put(chunk_key, chunk.tobytes())
+
+        written += 1
+
+    return written
+
+
+def _compact_history(kind, after, days, today):
+    """Compacts the history of the symbols after a symbol in a batch.
+
+    Only the days which need work are read for each symbol. Returns the last
+    symbol compacted or None once every symbol is done.
+
+    kind: str
+    after: bytes
+        The symbol to start after.
+    days: List[Tuple[int, int]]
+        The ranges of days to compact.
+    today: int
+    """
+    history = _histories[kind]
+    wb = history.write_batch()
+    symbol = None
+    written = 0
+
+    for _ in range(HISTORY_BATCH_SIZE):
+        key = next(history.iterator(start=after + b"\x01", include_value=False), None)
+
+        if key is None:
+            symbol = None
+            break
+
+        symbol = after = key[: key.index(b"\x00")]
+
+        for start, stop in days:
+            items = history.iterator(
+                start=_history_key(symbol.decode(), max(start, 0)),
+                stop=_history_key(symbol.decode(), max(stop, 0)),
+            )
+            written += _compact_chunks(wb, items, today)
+
+        if written >= HISTORY_BATCH_SIZE:
+            break
+
+    wb.write()
+    return symbol
+
+
+async def compact_history(kind):
+    """Compacts the ticks of previous days and applies the retention policy.
+
+    Only the days since the last compaction are visited: the days that have
+    ended, the days which are now past HISTORY_FULL_DAYS and the days which
+    are now past HISTORY_RETENTION_DAYS. Symbols are compacted in batches so
+    other db calls can run in between.
+
+    kind: str
+        Either stocks or crypto.
+    """
+    today = int(time.time() // 86400)
+    state_key = f"{kind}history_compacted".encode()
+    done = await run(db.get, state_key)
+    done = unpack_int(done) if done else 0
+
+    if done >= today:
+        return
+
+    days = []
+    ranges = sorted(
+        (done - age, today - age)
+        for age in (0, HISTORY_FULL_DAYS, HISTORY_RETENTION_DAYS)
+    )
+
+    # The ranges overlap on the first run as every day is visited
+    for start, stop in ranges:
+        if days and start <= days[-1][1]:
+            days[-1] = (days[-1][0], max(days[-1][1], stop))
+        else:
+            days.append((start, stop))
+
+    symbol = b""
+    while symbol is not None:
+        symbol = await run(_compact_history, kind, symbol, days, today)
+
+    await run(db.put, state_key, pack_int(today))
+
+
+_executor.submit(_migrate)
+_executor.submit(_build_baltop)
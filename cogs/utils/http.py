@@ -0,0 +1,229 @@
+import asyncio
+import time
+from collections import defaultdict
+from email.utils import parsedate_to_datetime
+import aiohttp
+from yarl import URL
+
+
+LIMIT = 100
+LIMIT_PER_HOST = 10
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 30
+TIMEOUT = aiohttp.ClientTimeout(total=60, connect=10)
+
+# Each host gets a token bucket refilled at RATE tokens a second up to BURST.
+# Requests wait for a token in a trace hook which runs after aiohttp has
+# started the requests total timeout but before its timer is registered, so
+# the wait counts towards the timeout. MAX_WAIT is kept below TIMEOUT and
+# requests with a shorter timeout acquire their token first with acquire.
+RATE = 5
+BURST = 10
+MAX_WAIT = 30
+RETRY_AFTER = 5
+
+# Per host counters of requests made through the shared session
+stats = defaultdict(
+    lambda: {
+        "requests": 0,
+        "errors": 0,
+        "created": 0,
+        "reused": 0,
+        "coalesced": 0,
+        "latency": 0.0,
+        "waited": 0.0,
+        "rate_limited": 0,
+        "rejected": 0,
+    }
+)
+
+# Futures of the requests currently being made keyed by normalized url
+_in_flight = {}
+
+
+class RateLimited(Exception):
+    """Raised when a request would have to wait for a host to allow it."""
+
+    def __init__(self, host, retry_after):
+        super().__init__(f"{host} is rate limited, try again in {retry_after:.1f}s")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Queues requests to a host so they are sent at most at RATE a second."""
+
+    def __init__(self):
+        self.tokens = BURST
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.waiting = 0
+        # asyncio.Lock wakes waiters in order so requests are sent first come
+        # first served
+        self.lock = asyncio.Lock()
+
+    def delay(self, queued=0):
+        """Returns how many seconds until a token is available.
+
+        queued: int
+            How many requests ahead in the queue take a token first.
+        """
+        now = time.monotonic()
+        self.tokens = min(BURST, self.tokens + (now - self.updated) * RATE)
+        self.updated = now
+
+        return max(self.blocked_until - now, (1 + queued - self.tokens) / RATE, 0)
+
+    async def acquire(self, host, wait=True):
+        """Waits for a token.
+
+        host: str
+        wait: bool
+            Whether to wait in the queue or raise RateLimited immediately.
+        """
+        delay = self.delay(self.waiting)
+
+        if (delay and not wait) or delay > MAX_WAIT:
+            stats[host]["rejected"] += 1
+            raise RateLimited(host, delay)
+
+        start = time.perf_counter()
+        self.waiting += 1
+
+        try:
+            async with self.lock:
+                while delay := self.delay():
+                    await asyncio.sleep(delay)
+                self.tokens -= 1
+        finally:
+            self.waiting -= 1
+            stats[host]["waited"] += time.perf_counter() - start
+
+    def retry_after(self, seconds):
+        """Stops any requests being sent for a number of seconds.
+
+        seconds: float
+        """
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+buckets = defaultdict(TokenBucket)
+
+
+def _parse_retry_after(value):
+    """Returns the seconds to wait from a Retry-After header.
+
+    value: str
+        Either a number of seconds or a http date.
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+
+    try:
+        return parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return RETRY_AFTER
+
+
+async def acquire(url, wait=True):
+    """Waits for a token to send a request to a urls host.
+
+    Requests which have acquired a token should pass
+    trace_request_ctx={"acquired": True} so they don't take another.
+
+    url: str
+    wait: bool
+        Whether to wait in the queue or raise RateLimited immediately.
+    """
+    host = URL(url).host
+    await buckets[host].acquire(host, wait)
+
+
+async def _on_request_start(session, context, params):
+    request_ctx = context.trace_request_ctx or {}
+
+    if not request_ctx.get("acquired"):
+        host = params.url.host
+        await buckets[host].acquire(host, request_ctx.get("wait", True))
+
+    context.start = time.perf_counter()
+    context.reused = False
+
+
+async def _on_connection_reuse(session, context, params):
+    context.reused = True
+
+
+async def _on_request_end(session, context, params):
+    host = stats[params.url.host]
+    host["requests"] += 1
+    host["latency"] += time.perf_counter() - context.start
+    host["reused" if context.reused else "created"] += 1
+
+    if params.response.status == 429:
+        host["rate_limited"] += 1
+        retry_after = _parse_retry_after(params.response.headers.get("Retry-After"))
+        buckets[params.url.host].retry_after(retry_after)
+
+
+async def _on_request_exception(session, context, params):
+    stats[params.url.host]["errors"] += 1
+
+
+async def create_session():
+    """Creates the session shared by every outbound http request.
+
+    This is a coroutine as aiohttp binds the session to the running loop.
+    Every request waits for its hosts token bucket, passing
+    trace_request_ctx={"wait": False} to a request makes it raise
+    RateLimited instead of waiting. Requests with a total timeout shorter
+    than MAX_WAIT should call acquire before they are sent instead.
+    """
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(_on_request_start)
+    trace_config.on_connection_reuseconn.append(_on_connection_reuse)
+    trace_config.on_request_end.append(_on_request_end)
+    trace_config.on_request_exception.append(_on_request_exception)
+
+    connector = aiohttp.TCPConnector(
+        limit=LIMIT,
+        limit_per_host=LIMIT_PER_HOST,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+    )
+
+    return aiohttp.ClientSession(
+        connector=connector, timeout=TIMEOUT, trace_configs=[trace_config]
+    )
+
+
+def normalize_url(url):
+    """Normalizes a url so the same request always has the same key.
+
+    url: str
+    """
+    url = URL(url)
+    return url.with_query(sorted(url.query.items()))
+
+
+async def single_flight(url, fetch):
+    """Runs fetch sharing the result with any concurrent calls for the same url.
+
+    Only the first caller runs fetch, later callers wait for its result so
+    concurrent identical requests cost one round trip.
+
+    url: str
+    fetch: Callable[[], Awaitable]
+    """
+    key = normalize_url(url)
+
+    if future := _in_flight.get(key):
+        stats[key.host]["coalesced"] += 1
+    else:
+        future = _in_flight[key] = asyncio.ensure_future(fetch())
+        future.add_done_callback(lambda _: _in_flight.pop(key, None))
+
+    # Shielded so one caller being cancelled doesn't cancel the others
+    return await asyncio.shield(future)
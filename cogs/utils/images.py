@@ -0,0 +1,179 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from PIL import Image, ImageDraw, ImageFont
+
+
+# Image jobs are CPU bound so they run in worker processes rather than
+# threads. Jobs are module level functions taking and returning bytes so
+# they can be pickled and this module mustn't import anything that opens
+# the db as workers may import it again.
+WORKERS = max(1, (os.cpu_count() or 2) // 2)
+QUEUE_LIMIT = 16
+# Larger vision images are scaled down before the predictions are drawn
+MAX_VISION_SIZE = 2048
+
+_executor = None
+_queued = 0
+
+
+class QueueFull(Exception):
+    """Raised when too many image jobs are already waiting."""
+
+    def __init__(self):
+        super().__init__("Too many images are being processed, try again soon")
+
+
+async def run(func, *args):
+    """Runs an image job in the worker pool and returns its result.
+
+    func: Callable
+        A module level function from this module.
+    """
+    global _executor, _queued
+
+    if _queued >= QUEUE_LIMIT:
+        raise QueueFull
+
+    if not _executor:
+        _executor = ProcessPoolExecutor(max_workers=WORKERS)
+
+    _queued += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+    finally:
+        _queued -= 1
+
+
+# Assets are loaded once per worker. Fonts are never modified by drawing so
+# they are shared while images are copied so renders can't change the cache.
+@functools.lru_cache(maxsize=32)
+def get_font(size, path="fonts/DejaVuSans.ttf"):
+    """Returns a font at a size loading it the first time it is used.
+
+    size: int
+    path: str
+    """
+    return ImageFont.truetype(path, size)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_image(path):
+    img = Image.open(path)
+    img.load()
+    return img
+
+
+def get_image(path):
+    """Returns a copy of an image decoding it the first time it is used.
+
+    path: str
+    """
+    return _load_image(path).copy()
+
+
+def _to_png(img):
+    """Encodes an image as a PNG.
+
+    img: PIL.Image.Image
+    """
+    with BytesIO() as image_binary:
+        img.save(image_binary, "PNG")
+        return image_binary.getvalue()
+
+
+def render_board(board):
+    """Renders a sunfish board as a PNG.
+
+    board: str
+    """
+    uni_pieces = {
+        "r": "♜",
+        "n": "♞",
+        "b": "♝",
+        "q": "♛",
+        "k": "♚",
+        "p": "♟",
+        "R": "♖",
+        "N": "♘",
+        "B": "♗",
+        "Q": "♕",
+        "K": "♔",
+        "P": "♙",
+        ".": "\u2004\u2004\u2005",
+    }
+    msg = ""
+    for row in board.split():
+        msg += f"{''.join(uni_pieces.get(p, p) for p in row)}\n"
+
+    background = get_image("fonts/chess.png")
+    img = Image.new("RGBA", (1024, 1050), (255, 0, 0, 0))
+
+    d = ImageDraw.Draw(img)
+    font = get_font(135)
+    d.text((40, 0), msg, font=font, fill=(0, 0, 0), spacing=4)
+    background.paste(img, (0, 0), img)
+
+    return _to_png(background)
+
+
+def draw_predictions(image, predictions, colors):
+    """Draws labeled bounding boxes over an image and returns it as a PNG.
+
+    image: bytes
+    predictions: list
+        The predictions from openvisionapi.
+    colors: dict
+        The RGB color of each label.
+    """
+    img = Image.open(BytesIO(image))
+    width = img.width
+
+    # JPEGs can be decoded at a reduced size which is much faster for photos
+    # but the boxes are relative to the original size
+    img.draft("RGB", (MAX_VISION_SIZE, MAX_VISION_SIZE))
+    img = img.convert("RGB")
+    scale = img.width / width
+
+    if max(img.size) > MAX_VISION_SIZE:
+        ratio = MAX_VISION_SIZE / max(img.size)
+        img = img.resize(
+            (round(img.width * ratio), round(img.height * ratio)), Image.LANCZOS
+        )
+        scale *= ratio
+
+    # Drawing in RGBA mode blends each shape straight onto the image so there
+    # is no need for a mask and composite per prediction
+    draw = ImageDraw.Draw(img, "RGBA")
+    font = get_font(round(img.width / 25))
+
+    for prediction in predictions:
+        x1, y1, x2, y2 = (
+            prediction["bbox"][point] * scale for point in ("x1", "y1", "x2", "y2")
+        )
+        label = prediction["label"]
+        color = colors[label] + (96,)
+        text_x, text_y = font.getsize(label)
+
+        draw.rectangle(((x1, y1), (x2, y2)), fill=color)
+        if (y1 - text_y) > 0 and x1 > 0 and x2 > 0:
+            draw.rectangle(((x1, y1 - text_y), (x1 + text_x, y1)), fill=color)
+        else:
+            text_y = 0
+
+        draw.text((x1, y1 - text_y), text=label, fill="white", font=font)
+
+    return _to_png(img)
+
+
+def make_emoji(image):
+    """Shrinks an image to fit in an emoji and returns it as a PNG.
+
+    image: bytes
+    """
+    img = Image.open(BytesIO(image))
+    img.thumbnail((256, 256), Image.LANCZOS)
+
+    return _to_png(img)
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+import orjson
+import cogs.utils.database as DB
+
+
+# How many due timers are read from the db at once
+BATCH_SIZE = 100
+
+# Timers are stored in the db as an action name and its json arguments so
+# they survive restarts. One task sleeps until the earliest timer is due and
+# is woken early when an earlier timer is scheduled or a handler registered.
+# Due timers whose handler isn't registered, e.g. while their cog is
+# unloaded, are kept until it is.
+_handlers = {}
+_task = None
+_wakeup = None
+_next_due = None
+
+
+def register(action, func):
+    """Sets the coroutine function run when an actions timers are due.
+
+    action: str
+    func: Callable[..., Awaitable]
+        Called with the timers arguments.
+    """
+    _handlers[action] = func
+
+    if _wakeup:
+        _wakeup.set()
+
+
+def unregister(action):
+    """Removes an actions handler, its timers are kept until it is registered.
+
+    action: str
+    """
+    _handlers.pop(action, None)
+
+
+def schedule(delay, action, *args, name=None):
+    """Schedules an action to run after a delay.
+
+    delay: float
+        How many seconds until the action runs.
+    action: str
+    args
+        Json serializable arguments passed to the actions handler.
+    name: str
+        Lets the timer be cancelled, scheduling another timer with the same
+        name replaces it.
+    """
+    global _next_due
+
+    if name:
+        cancel(name)
+
+    due_at = time.time() + delay
+    DB.put_timer(due_at, orjson.dumps([action, args, name]), name)
+
+    if _wakeup and (_next_due is None or due_at < _next_due):
+        _next_due = due_at
+        _wakeup.set()
+
+
+def cancel(name):
+    """Cancels a named timer if it is scheduled.
+
+    name: str
+    """
+    if key := DB.get_timer(name):
+        DB.delete_timer(key, name)
+
+
+async def _fire(action, args, name):
+    """Runs the handler of a due timer.
+
+    action: str
+    args: list
+    name: str
+    """
+    if not (handler := _handlers.get(action)):
+        # Unregistered after the timer was taken so it's stored again unless
+        # a timer with its name was scheduled since
+        if not (name and DB.get_timer(name)):
+            DB.put_timer(time.time(), orjson.dumps([action, args, name]), name)
+        return
+
+    try:
+        await handler(*args)
+    except Exception as e:
+        logging.getLogger("discord").warning(f"Timer {action} failed: {e}")
+
+
+async def _run():
+    """Runs timers as they become due."""
+    global _next_due
+
+    while True:
+        _wakeup.clear()
+        due, _next_due = await DB.get_due_timers(time.time(), BATCH_SIZE, _handlers)
+
+        for key, action, args, name in due:
+            # The handler may have been unregistered while the timers were read
+            if action not in _handlers:
+                continue
+
+            DB.delete_timer(key, name)
+            asyncio.create_task(_fire(action, args, name))
+
+        if len(due) == BATCH_SIZE:
+            continue
+
+        timeout = None if _next_due is None else max(_next_due - time.time(), 0)
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start():
+    """Starts running timers, any that became due while offline run first.
+
+    Should be called once the handlers are registered and the bot is ready.
+    """
+    global _task, _wakeup
+
+    if _task:
+        return
+
+    _wakeup = asyncio.Event()
+    _task = asyncio.create_task(_run())
@@ -0,0 +1,619 @@
+import math
+import random
+import time
+from itertools import count
+from collections import namedtuple
+
+# Source
+# https://github.com/thomasahle/sunfish/blob/master/LICENSE.md
+# https://github.com/thomasahle/sunfish
+# Modified a little to work with discord
+
+# fmt: off
+
+piece = {'P': 100, 'N': 280, 'B': 320, 'R': 479, 'Q': 929, 'K': 60000}
+pst = {
+    'P': (0,   0,   0,   0,   0,   0,   0,   0,
+          78,  83,  86,  73, 102,  82,  85,  90,
+          7,  29,  21,  44,  40,  31,  44,   7,
+          -17,  16,  -2,  15,  14,   0,  15, -13,
+          -26,   3,  10,   9,   6,   1,   0, -23,
+          -22,   9,   5, -11, -10,  -2,   3, -19,
+          -31,   8,  -7, -37, -36, -14,   3, -31,
+          0,   0,   0,   0,   0,   0,   0,   0),
+    'N': (-66, -53, -75, -75, -10, -55, -58, -70,
+          -3,  -6, 100, -36,   4,  62,  -4, -14,
+          10,  67,   1,  74,  73,  27,  62,  -2,
+          24,  24,  45,  37,  33,  41,  25,  17,
+          -1,   5,  31,  21,  22,  35,   2,   0,
+          -18,  10,  13,  22,  18,  15,  11, -14,
+          -23, -15,   2,   0,   2,   0, -23, -20,
+          -74, -23, -26, -24, -19, -35, -22, -69),
+    'B': (-59, -78, -82, -76, -23, -107, -37, -50,
+          -11,  20,  35, -42, -39,  31,   2, -22,
+          -9,  39, -32,  41,  52, -10,  28, -14,
+          25,  17,  20,  34,  26,  25,  15,  10,
+          13,  10,  17,  23,  17,  16,   0,   7,
+          14,  25,  24,  15,   8,  25,  20,  15,
+          19,  20,  11,   6,   7,   6,  20,  16,
+          -7,   2, -15, -12, -14, -15, -10, -10),
+    'R': (35,  29,  33,   4,  37,  33,  56,  50,
+          55,  29,  56,  67,  55,  62,  34,  60,
+          19,  35,  28,  33,  45,  27,  25,  15,
+          0,   5,  16,  13,  18,  -4,  -9,  -6,
+          -28, -35, -16, -21, -13, -29, -46, -30,
+          -42, -28, -42, -25, -25, -35, -26, -46,
+          -53, -38, -31, -26, -29, -43, -44, -53,
+          -30, -24, -18,   5,  -2, -18, -31, -32),
+    'Q': (6,   1, -8, -104, 69,  24, 88, 26,
+          14,  32,  60, -10,  20,  76,  57,  24,
+          -2,  43,  32,  60,  72,  63,  43,   2,
+          1, -16,  22,  17,  25,  20, -13,  -6,
+          -14, -15,  -2,  -5,  -1, -10, -20, -22,
+          -30,  -6, -13, -11, -16, -11, -16, -27,
+          -36, -18,   0, -19, -15, -15, -21, -38,
+          -39, -30, -31, -13, -31, -36, -34, -42),
+    'K': (4,  54,  47, -99, -99,  60,  83, -62,
+          -32,  10,  55,  56,  56,  55,  10,   3,
+          -62,  12, -57,  44, -67,  28,  37, -31,
+          -55,  50,  11,  -4, -19,  13,   0, -49,
+          -55, -43, -52, -28, -51, -47,  -8, -50,
+          -47, -42, -43, -79, -64, -32, -29, -32,
+          -4,   3, -14, -50, -57, -18,  13,   4,
+          17,  30,  -3, -14,   6,  -1,  40,  18),
+}
+
+# fmt: on
+
+for k, table in pst.items():
+
+    def padrow(row):
+        return (0,) + tuple(x + piece[k] for x in row) + (0,)
+
+    # fmt: off
+    pst[k] = sum((padrow(table[i * 8: i * 8 + 8]) for i in range(8)), ())
+    # fmt: on
+    pst[k] = (0,) * 20 + pst[k] + (0,) * 20
+
+
+A1, H1, A8, H8 = 91, 98, 21, 28
+initial = (
+    b"         \n"  # 0 -  9
+    b"         \n"  # 10 - 19
+    b" rnbqkbnr\n"  # 20 - 29
+    b" pppppppp\n"  # 30 - 39
+    b" ........\n"  # 40 - 49
+    b" ........\n"  # 50 - 59
+    b" ........\n"  # 60 - 69
+    b" ........\n"  # 70 - 79
+    b" PPPPPPPP\n"  # 80 - 89
+    b" RNBQKBNR\n"  # 90 - 99
+    b"         \n"  # 100 -109
+    b"         \n"  # 110 -119
+)
+
+N, E, S, W = -10, 1, 10, -1
+directions = {
+    "P": (N, N + N, N + W, N + E),
+    "N": (
+        N + N + E,
+        E + N + E,
+        E + S + E,
+        S + S + E,
+        S + S + W,
+        W + S + W,
+        W + N + W,
+        N + N + W,
+    ),
+    "B": (N + E, S + E, S + W, N + W),
+    "R": (N, E, S, W),
+    "Q": (N, E, S, W, N + E, S + E, S + W, N + W),
+    "K": (N, E, S, W, N + E, S + E, S + W, N + W),
+}
+
+MATE_LOWER = piece["K"] - 10 * piece["Q"]
+MATE_UPPER = piece["K"] + 10 * piece["Q"]
+
+# The memory each game's transposition tables can use
+TABLE_MB = 64
+
+QS_LIMIT = 219
+EVAL_ROUGHNESS = 13
+DRAW_TEST = True
+
+# The board is stored as bytes so squares are looked up as ints in these
+# tables rather than calling str methods on every square.
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = b"PNBRQK"
+EMPTY = ord(".")
+OWN = tuple(chr(c).isupper() for c in range(256))
+ENEMY = tuple(chr(c).islower() for c in range(256))
+OFF_BOARD = tuple(chr(c).isspace() for c in range(256))
+SWAPCASE = bytes(ord(chr(c).swapcase()) if c < 128 else c for c in range(256))
+piece_directions = [directions.get(chr(c)) for c in range(256)]
+piece_pst = [pst.get(chr(c)) for c in range(256)]
+
+# Zobrist keys for each piece on each square indexed by the pieces byte.
+# Empty squares hash to 0 so a boards hash is the xor of its pieces keys,
+# zobrist_rotated holds the keys of the same square once the board rotates.
+_rng = random.Random(0)
+zobrist = [(0,) * 120] * 256
+for c in b"PNBRQKpnbrqk":
+    zobrist[c] = tuple(_rng.getrandbits(64) for _ in range(120))
+zobrist_rotated = [zobrist[SWAPCASE[c]][::-1] for c in range(256)]
+# Keys for the castling rights and en passant and king passant squares which
+# only position_key mixes in as they aren't part of the board
+zobrist_castling = [_rng.getrandbits(64) for _ in range(16)]
+zobrist_ep = [_rng.getrandbits(64) for _ in range(120)]
+zobrist_kp = [_rng.getrandbits(64) for _ in range(120)]
+
+
+def zobrist_hash(board):
+    """Returns the hashes of a board and of the board rotated.
+
+    board: bytes
+    """
+    hashed = rotated = 0
+    for i, p in enumerate(board):
+        hashed ^= zobrist[p][i]
+        rotated ^= zobrist_rotated[p][i]
+    return hashed, rotated
+
+
+def _put(board, hashes, i, p):
+    """Puts a piece on a square updating the hashes and returns them.
+
+    board: bytearray
+    hashes: tuple
+    i: int
+    p: int
+    """
+    q = board[i]
+    board[i] = p
+    return (
+        hashes[0] ^ zobrist[q][i] ^ zobrist[p][i],
+        hashes[1] ^ zobrist_rotated[q][i] ^ zobrist_rotated[p][i],
+    )
+
+
+class Position(namedtuple("Position", "board score wc bc ep kp hashes")):
+    """A state of a chess game.
+    board -- a 120 byte representation of the board
+    score -- the board evaluation
+    wc -- the castling rights, [west/queen side, east/king side]
+    bc -- the opponent castling rights, [west/king side, east/queen side]
+    ep - the en passant square
+    kp - the king passant square
+    hashes - the zobrist hashes of the board and the rotated board
+    """
+
+    def __new__(cls, board, score, wc, bc, ep, kp, hashes=None):
+        return super().__new__(
+            cls, board, score, wc, bc, ep, kp, hashes or zobrist_hash(board)
+        )
+
+    def gen_moves(self):
+        board = self.board
+        for i, p in enumerate(board):
+            if not OWN[p]:
+                continue
+            for d in piece_directions[p]:
+                for j in count(i + d, d):
+                    q = board[j]
+                    if OFF_BOARD[q] or OWN[q]:
+                        break
+                    if p == PAWN:
+                        if d in (N, N + N) and q != EMPTY:
+                            break
+                        if d == N + N and (i < A1 + N or board[i + N] != EMPTY):
+                            break
+                        if (
+                            d in (N + W, N + E)
+                            and q == EMPTY
+                            and j not in (self.ep, self.kp, self.kp - 1, self.kp + 1)
+                        ):
+                            break
+                    yield (i, j)
+                    if p in (PAWN, KNIGHT, KING) or ENEMY[q]:
+                        break
+                    if i == A1 and board[j + E] == KING and self.wc[0]:
+                        yield (j + E, j + W)
+                    if i == H1 and board[j + W] == KING and self.wc[1]:
+                        yield (j + W, j + E)
+
+    def rotate(self):
+        """Rotates the board, preserving enpassant."""
+        return Position(
+            self.board[::-1].translate(SWAPCASE),
+            -self.score,
+            self.bc,
+            self.wc,
+            119 - self.ep or 0,
+            119 - self.kp or 0,
+            self.hashes[::-1],
+        )
+
+    def nullmove(self):
+        """Like rotate, but clears ep and kp."""
+        return Position(
+            self.board[::-1].translate(SWAPCASE),
+            -self.score,
+            self.bc,
+            self.wc,
+            0,
+            0,
+            self.hashes[::-1],
+        )
+
+    def move(self, move):
+        i, j = move
+        board = bytearray(self.board)
+        p, q = board[i], board[j]
+        wc, bc, ep, kp = self.wc, self.bc, 0, 0
+        score = self.score + self.value(move)
+
+        # The hashes are updated incrementally rather than rehashing the board
+        hashed, rotated = self.hashes
+        hashes = (
+            hashed ^ zobrist[p][i] ^ zobrist[p][j] ^ zobrist[q][j],
+            rotated
+            ^ zobrist_rotated[p][i]
+            ^ zobrist_rotated[p][j]
+            ^ zobrist_rotated[q][j],
+        )
+        board[j] = p
+        board[i] = EMPTY
+
+        if i == A1:
+            wc = (False, wc[1])
+        if i == H1:
+            wc = (wc[0], False)
+        if j == A8:
+            bc = (bc[0], False)
+        if j == H8:
+            bc = (False, bc[1])
+
+        if p == KING:
+            wc = (False, False)
+            if abs(j - i) == 2:
+                kp = (i + j) // 2
+                hashes = _put(board, hashes, A1 if j < i else H1, EMPTY)
+                hashes = _put(board, hashes, kp, ROOK)
+
+        if p == PAWN:
+            if A8 <= j <= H8:
+                hashes = _put(board, hashes, j, QUEEN)
+            if j - i == 2 * N:
+                ep = i + N
+            if j == self.ep:
+                hashes = _put(board, hashes, j + S, EMPTY)
+
+        return Position(bytes(board), score, wc, bc, ep, kp, hashes).rotate()
+
+    def value(self, move):
+        i, j = move
+        p, q = self.board[i], self.board[j]
+
+        score = piece_pst[p][j] - piece_pst[p][i]
+
+        if ENEMY[q]:
+            score += piece_pst[SWAPCASE[q]][119 - j]
+
+        if abs(j - self.kp) < 2:
+            score += pst["K"][119 - j]
+
+        if p == KING and abs(i - j) == 2:
+            score += pst["R"][(i + j) // 2]
+            score -= pst["R"][A1 if j < i else H1]
+
+        if p == PAWN:
+            if A8 <= j <= H8:
+                score += pst["Q"][j] - pst["P"][j]
+            if j == self.ep:
+                score += pst["P"][119 - (j + S)]
+        return score
+
+
+Entry = namedtuple("Entry", "lower upper")
+
+# Roughly how many bytes a table slot uses counting the key, value and the
+# list pointers to them
+SLOT_BYTES = 160
+
+
+def position_key(pos):
+    """Returns a 64 bit int identifying a position.
+
+    The keys come from a seeded generator so they are the same in every
+    process and can be stored in the opening book and the db.
+
+    pos: Position
+    """
+    wc, bc = pos.wc, pos.bc
+    return (
+        pos.hashes[0]
+        ^ zobrist_castling[wc[0] | wc[1] << 1 | bc[0] << 2 | bc[1] << 3]
+        ^ zobrist_ep[pos.ep]
+        ^ zobrist_kp[pos.kp]
+    )
+
+
+class TranspositionTable:
+    """A fixed size hash table that replaces entries when their slots collide.
+
+    An entry is only replaced by one searched at least as deep unless it is
+    from an older search so the most expensive results are kept.
+    """
+
+    def __init__(self, megabytes):
+        self.size = max(1, int(megabytes * 2**20 // SLOT_BYTES))
+        self.keys = [None] * self.size
+        self.values = [None] * self.size
+        self.depths = [0] * self.size
+        self.ages = [0] * self.size
+        self.age = 0
+        self.cleared = 0
+        self.filled = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Gets the value of a key.
+
+        key: int
+        default
+            Returned if the key isn't in the table.
+        """
+        index = key % self.size
+
+        if self.keys[index] == key and self.ages[index] >= self.cleared:
+            self.hits += 1
+            return self.values[index]
+
+        self.misses += 1
+        return default
+
+    def put(self, key, value, depth=0, force=False):
+        """Stores a value if it is worth more than what is in its slot.
+
+        key: int
+        value
+        depth: int
+            How deep the value was searched.
+        force: bool
+            Whether to always replace the slot.
+        """
+        index = key % self.size
+        stored = self.keys[index]
+
+        if stored is None:
+            self.filled += 1
+        elif (
+            not force
+            and stored != key
+            and self.ages[index] == self.age
+            and self.depths[index] > depth
+        ):
+            return
+
+        self.keys[index] = key
+        self.values[index] = value
+        self.depths[index] = depth
+        self.ages[index] = self.age
+
+    def new_search(self):
+        """Makes the current entries replaceable by the next search."""
+        self.age += 1
+
+    def clear(self):
+        """Makes every current entry invisible without reallocating."""
+        self.new_search()
+        self.cleared = self.age
+
+    def stats(self):
+        """Returns the hit rate and how full the table is."""
+        lookups = self.hits + self.misses
+        return {
+            "hit_rate": self.hits / lookups if lookups else 0,
+            "filled": self.filled / self.size,
+        }
+
+
+class SearchTimeout(Exception):
+    """Raised inside a search once it has run out of time or nodes."""
+
+
+class Searcher:
+    def __init__(self, table_mb=TABLE_MB):
+        # The score table is cleared every search so gets most of the memory
+        self.tp_score = TranspositionTable(table_mb * 3 / 4)
+        self.tp_move = TranspositionTable(table_mb / 4)
+        self.history = set()
+        self.nodes = 0
+        self.deadline = math.inf
+        self.node_limit = math.inf
+
+    def bound(self, pos, gamma, depth, root=True):
+        """Returns r where.
+        s(pos) <= r < gamma    if gamma > s(pos)
+        gamma <= r <= s(pos)   if gamma <= s(pos)
+        """
+        self.nodes += 1
+
+        # Checking the time is slow so it is only done every 1024 nodes
+        if self.nodes >= self.node_limit or (
+            not self.nodes & 1023 and time.monotonic() > self.deadline
+        ):
+            raise SearchTimeout
+
+        depth = max(depth, 0)
+
+        if pos.score <= -MATE_LOWER:
+            return -MATE_UPPER
+
+        if DRAW_TEST and not root and pos in self.history:
+            return 0
+
+        key = position_key(pos)
+        score_key = hash((key, depth, root))
+        entry = self.tp_score.get(score_key, Entry(-MATE_UPPER, MATE_UPPER))
+        if entry.lower >= gamma and (not root or self.tp_move.get(key) is not None):
+            return entry.lower
+        if entry.upper < gamma:
+            return entry.upper
+
+        def moves():
+
+            if depth > 0 and not root and any(c in pos.board for c in b"RBNQ"):
+                yield None, -self.bound(
+                    pos.nullmove(), 1 - gamma, depth - 3, root=False
+                )
+
+            if depth == 0:
+                yield None, pos.score
+
+            killer = self.tp_move.get(key)
+            if killer and (depth > 0 or pos.value(killer) >= QS_LIMIT):
+                yield killer, -self.bound(
+                    pos.move(killer), 1 - gamma, depth - 1, root=False
+                )
+
+            for move in sorted(pos.gen_moves(), key=pos.value, reverse=True):
+
+                if depth > 0 or pos.value(move) >= QS_LIMIT:
+                    yield move, -self.bound(
+                        pos.move(move), 1 - gamma, depth - 1, root=False
+                    )
+
+        best = -MATE_UPPER
+        for move, score in moves():
+            best = max(best, score)
+            if best >= gamma:
+                self.tp_move.put(key, move, depth, root)
+                break
+
+        if best < gamma and best < 0 and depth > 0:
+
+            def is_dead(pos):
+                return any(pos.value(m) >= MATE_LOWER for m in pos.gen_moves())
+
+            if all(is_dead(pos.move(m)) for m in pos.gen_moves()):
+                in_check = is_dead(pos.nullmove())
+                best = -MATE_UPPER if in_check else 0
+
+        if best >= gamma:
+            self.tp_score.put(score_key, Entry(best, entry.upper), depth, root)
+        if best < gamma:
+            self.tp_score.put(score_key, Entry(entry.lower, best), depth, root)
+
+        return best
+
+    def search(self, pos, history=(), time_limit=None, node_limit=None):
+        """Iterative deepening MTD-bi search.
+
+        The search stops part way through a depth once time_limit seconds
+        have passed or node_limit nodes have been searched. The first depth
+        is always finished so there is always a move.
+        """
+        self.nodes = 0
+        self.deadline = self.node_limit = math.inf
+        deadline = time.monotonic() + time_limit if time_limit else math.inf
+
+        key = position_key(pos)
+        self.tp_move.new_search()
+
+        if DRAW_TEST:
+            self.history = set(history)
+            self.tp_score.clear()
+        else:
+            self.tp_score.new_search()
+
+        try:
+            for depth in range(1, 1000):
+                lower, upper = -MATE_UPPER, MATE_UPPER
+                while lower < upper - EVAL_ROUGHNESS:
+                    gamma = (lower + upper + 1) // 2
+                    score = self.bound(pos, gamma, depth)
+                    if score >= gamma:
+                        lower = score
+                    if score < gamma:
+                        upper = score
+
+                self.bound(pos, lower, depth)
+
+                # Root entries are always stored so they can't be missing
+                yield depth, self.tp_move.get(key), self.tp_score.get(
+                    hash((key, depth, True))
+                ).lower
+
+                self.deadline = deadline
+                self.node_limit = node_limit or math.inf
+        except SearchTimeout:
+            return
+
+
+def parse(c):
+    fil, rank = ord(c[0]) - ord("a"), int(c[1]) - 1
+    return A1 + fil - 10 * rank
+
+
+def render(i):
+    rank, fil = divmod(i - A1, 10)
+    return chr(fil + ord("a")) + str(-rank + 1)
+
+
+# Strength levels as (seconds, nodes) the engine can search per move
+LEVELS = {
+    1: (0.05, 2_000),
+    2: (0.15, 10_000),
+    3: (0.3, 50_000),
+    4: (1, 200_000),
+    5: (3, None),
+}
+
+# Games are spread over a few worker processes which keep a searcher per game
+# keyed by its id so each games tables stay warm between moves
+_searchers = {}
+
+
+def new_game(game_id, table_mb=TABLE_MB):
+    """Starts a new game in a worker process.
+
+    game_id: int
+    table_mb: float
+        The memory the games transposition tables can use.
+    """
+    _searchers[game_id] = Searcher(table_mb)
+
+
+def end_game(game_id):
+    """Frees a games searcher returning the hit rates and fill of its tables.
+
+    game_id: int
+    """
+    searcher = _searchers.pop(game_id)
+    return {
+        "score": searcher.tp_score.stats(),
+        "move": searcher.tp_move.stats(),
+    }
+
+
+def think(game_id, pos, history, level):
+    """Searches for the best move in a game.
+
+    Returns the move and its score.
+
+    game_id: int
+    pos: Position
+    history: list
+        The previous positions of the game.
+    level: int
+        The strength level to search at.
+    """
+    move = score = None
+    searcher = _searchers[game_id]
+
+    for _depth, move, score in searcher.search(pos, history, *LEVELS[level]):
+        if score == MATE_UPPER:
+            break
+
+    return move, score
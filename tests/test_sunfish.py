@@ -0,0 +1,86 @@
+from cogs.utils.sunfish import MATE_LOWER, Position, initial, zobrist_hash
+
+
+# Known move counts from the starting position at depths 1 to 4
+PERFT = (20, 400, 8902, 197281)
+
+# The "Kiwipete" position which has castling, en passant, pins and checks
+# early on, with its known move counts at depths 1 to 3
+KIWIPETE = "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R"
+KIWIPETE_PERFT = (48, 2039, 97862)
+
+
+def start():
+    return Position(initial, 0, (True, True), (True, True), 0, 0)
+
+
+def from_fen(placement):
+    """Returns the position with white to move and both sides able to castle.
+
+    placement: str
+        The piece placement field of a FEN.
+    """
+    rows = (
+        "".join("." * int(c) if c.isdigit() else c for c in row)
+        for row in placement.split("/")
+    )
+    board = "         \n" * 2 + "".join(f" {row}\n" for row in rows) + "         \n" * 2
+    return Position(board.encode(), 0, (True, True), (True, True), 0, 0)
+
+
+def legal_moves(pos):
+    """Yields the positions after each move which doesn't leave the king capturable.
+
+    pos: Position
+    """
+    for move in pos.gen_moves():
+        after = pos.move(move)
+
+        if not any(after.value(reply) >= MATE_LOWER for reply in after.gen_moves()):
+            yield after
+
+
+def perft(pos, depth):
+    """Counts the leaf positions at a depth.
+
+    pos: Position
+    depth: int
+    """
+    if not depth:
+        return 1
+    return sum(perft(after, depth - 1) for after in legal_moves(pos))
+
+
+def check_hashes(pos, depth):
+    """Checks the incremental hashes match a full rehash down to a depth.
+
+    pos: Position
+    depth: int
+    """
+    assert pos.hashes == zobrist_hash(pos.board)
+
+    if depth:
+        for move in pos.gen_moves():
+            check_hashes(pos.move(move), depth - 1)
+
+
+def test_perft():
+    pos = start()
+
+    for depth, count in enumerate(PERFT, start=1):
+        assert perft(pos, depth) == count
+
+
+def test_perft_kiwipete():
+    pos = from_fen(KIWIPETE)
+
+    for depth, count in enumerate(KIWIPETE_PERFT, start=1):
+        assert perft(pos, depth) == count
+
+
+def test_incremental_hashes():
+    check_hashes(start(), 3)
+
+
+def test_incremental_hashes_kiwipete():
+    check_hashes(from_fen(KIWIPETE), 3)